@@ -0,0 +1,408 @@
+"""
+Euler tour (preorder interval) index for attachment hierarchies.
+
+attachment.has_ancestor walks up the parent chain, which makes cycle
+checks O(depth) and bulk reparenting of deep trees quadratic.
+AncestryIndex keeps all tracked entities in one preorder array instead.
+Every subtree is a contiguous block of that array, so with
+
+- ``tin[slot]``: position of the slot in the preorder array
+- ``size[slot]``: number of slots in its subtree (including itself)
+- ``depth[slot]``: 0 for roots
+
+ancestor, depth and subtree size queries are O(1).
+
+Moving a subtree cuts its block out of the preorder array and inserts it
+right behind the block of the new parent. That is a couple of vectorized
+NumPy operations without a Python loop over the hierarchy, but it copies
+the preorder array and rewrites ``tin`` behind the block, so a single
+add, move or remove is O(n). k single edits cost O(k n); batches
+(add_many, reparent_many, remove_many) are validated up front and
+rebuild the whole index once, O(n log n) per batch. Callers with more
+than one change should always use those; a reparent_many with a single
+edge is a plain move.
+
+Lowest common ancestors come from a range minimum query over the depths
+in preorder, O(1) with a sparse table. Every change invalidates the
+table, and rebuilding it is O(n log n), so right after a change queries
+walk up the parent chain instead (O(depth), each step an O(1) ancestor
+check). Once those walks added up to n steps since the last change the
+table is rebuilt, and queries are O(1) again until the next change.
+"""
+import numpy as np
+from transforms import forest_depths
+
+
+class AncestryIndex(object):
+    """
+    Ancestry queries for a forest of entities.
+    Every entity counts as its own ancestor, so attaching child to parent
+    creates a cycle exactly if is_ancestor(child, parent).
+    """
+    def __init__(self, capacity=256):
+        self.capacity = 0
+        self.count = 0
+        self._slots = {}
+        self._free_slots = []
+        self._sparse = None
+        # Parent chain steps walked by lca queries since the last change
+        self._walked = 0
+        self.preorder = np.zeros(0, dtype=np.intp)
+        self.entity_id = np.empty(0, dtype=np.intp)
+        self.parent = np.empty(0, dtype=np.intp)
+        self.tin = np.empty(0, dtype=np.intp)
+        self.size = np.empty(0, dtype=np.intp)
+        self.depth = np.empty(0, dtype=np.intp)
+        self._grow(max(1, capacity))
+
+    def _grow(self, capacity):
+        old = self.capacity
+        for name in ('entity_id', 'parent', 'tin', 'size', 'depth'):
+            array = getattr(self, name)
+            new = np.empty(capacity, dtype=array.dtype)
+            new[:old] = array[:old]
+            new[old:] = -1 if name in ('entity_id', 'parent') else 0
+            setattr(self, name, new)
+        self._free_slots.extend(range(capacity - 1, old - 1, -1))
+        self.capacity = capacity
+
+    def __len__(self):
+        return self.count
+
+    def _invalidate(self):
+        self._sparse = None
+        self._walked = 0
+
+    def __contains__(self, entity_id):
+        return entity_id in self._slots
+
+    def _ancestors_of_position(self, position):
+        """
+        Slots whose subtree block contains the given preorder position.
+        """
+        candidates = self.preorder[:position + 1]
+        ends = self.tin[candidates] + self.size[candidates]
+        return candidates[ends > position]
+
+    def _cut(self, slot):
+        lo = self.tin[slot]
+        hi = lo + self.size[slot]
+        preorder = self.preorder
+        block = preorder[lo:hi].copy()
+        ancestors = self._ancestors_of_position(lo)
+        self.size[ancestors[ancestors != slot]] -= hi - lo
+        preorder = np.concatenate((preorder[:lo], preorder[hi:]))
+        self.tin[preorder[lo:]] = np.arange(lo, len(preorder))
+        self.preorder = preorder
+        self._invalidate()
+        return block
+
+    def _insert(self, block, parent_slot):
+        preorder = self.preorder
+        if parent_slot == -1:
+            position = len(preorder)
+            new_depth = 0
+        else:
+            position = self.tin[parent_slot] + self.size[parent_slot]
+            new_depth = self.depth[parent_slot] + 1
+            ancestors = self._ancestors_of_position(self.tin[parent_slot])
+            self.size[ancestors] += len(block)
+        self.depth[block] += new_depth - self.depth[block[0]]
+        self.parent[block[0]] = parent_slot
+        preorder = np.concatenate((preorder[:position], block,
+                                   preorder[position:]))
+        self.tin[preorder[position:]] = np.arange(position, len(preorder))
+        self.preorder = preorder
+        self._invalidate()
+
+    def add(self, entity_id, parent_id=-1):
+        """
+        Add a new leaf entity below parent_id (-1 for a root).
+        """
+        if entity_id in self._slots:
+            raise ValueError("Entity %i is already tracked." % entity_id)
+        parent_slot = -1 if parent_id == -1 else self._slots[parent_id]
+        if not self._free_slots:
+            self._grow(self.capacity * 2)
+        slot = self._free_slots.pop()
+        self._slots[entity_id] = slot
+        self.entity_id[slot] = entity_id
+        self.size[slot] = 1
+        self.depth[slot] = 0
+        self.count += 1
+        self._insert(np.array([slot], dtype=np.intp), parent_slot)
+
+    def _rebuild(self, parent):
+        """
+        Recompute preorder, tin, size and depth from a parent index array.
+        Raises ValueError (and keeps the old state) if it has cycles.
+        """
+        used = self.entity_id >= 0
+        depth = forest_depths(parent, used)
+        slots = np.flatnonzero(used)
+        # Keep siblings (and roots) in their current preorder position,
+        # new slots go last.
+        tin = np.where(self.tin[slots] >= 0, self.tin[slots], len(slots))
+        slots = slots[np.lexsort((tin, depth[slots]))]
+        bounds = np.searchsorted(depth[slots],
+                                 np.arange(depth[slots].max() + 2)
+                                 if len(slots) else [0])
+        levels = [slots[lo:hi] for lo, hi in zip(bounds[:-1], bounds[1:])]
+        size = np.zeros(self.capacity, dtype=np.intp)
+        size[slots] = 1
+        for level in reversed(levels[1:]):
+            np.add.at(size, parent[level], size[level])
+        tin = np.zeros(self.capacity, dtype=np.intp)
+        for index, level in enumerate(levels):
+            if index:
+                level = level[np.argsort(parent[level], kind='stable')]
+                owner = parent[level]
+                offset = tin[owner] + 1
+            else:
+                owner = np.zeros(len(level), dtype=np.intp)
+                offset = 0
+            # Exclusive running sum of the sibling sizes, restarting for
+            # every parent.
+            before = np.cumsum(size[level]) - size[level]
+            first = np.flatnonzero(np.r_[True, owner[1:] != owner[:-1]])
+            counts = np.diff(np.r_[first, len(level)])
+            before -= np.repeat(before[first], counts)
+            tin[level] = offset + before
+        preorder = np.empty(len(slots), dtype=np.intp)
+        preorder[tin[slots]] = slots
+        self.parent = parent
+        self.depth = depth
+        self.size = size
+        self.tin = tin
+        self.preorder = preorder
+        self._invalidate()
+
+    def add_many(self, entity_ids, parent_ids):
+        """
+        Add a batch of entities with a single rebuild. Parents may be
+        part of the batch itself, in any order.
+        """
+        entity_ids = list(entity_ids)
+        parent_ids = list(parent_ids)
+        slots = self._slots
+        if len(set(entity_ids)) != len(entity_ids) or any(
+                entity_id in slots for entity_id in entity_ids):
+            raise ValueError("Entities are already tracked.")
+        new_ids = set(entity_ids)
+        for parent_id in parent_ids:
+            if parent_id != -1 and not (parent_id in slots or
+                                        parent_id in new_ids):
+                raise KeyError(parent_id)
+        while len(self._free_slots) < len(entity_ids):
+            self._grow(self.capacity * 2)
+        free = self._free_slots[len(self._free_slots) - len(entity_ids):]
+        new_slots = dict(zip(entity_ids, reversed(free)))
+        parent = self.parent.copy()
+        for entity_id, parent_id in zip(entity_ids, parent_ids):
+            parent[new_slots[entity_id]] = -1 if parent_id == -1 else \
+                new_slots.get(parent_id, slots.get(parent_id))
+        new = np.array(list(new_slots.values()), dtype=np.intp)
+        self.entity_id[new] = entity_ids
+        self.tin[new] = -1
+        try:
+            self._rebuild(parent)
+        except ValueError:
+            self.entity_id[new] = -1
+            raise
+        del self._free_slots[len(self._free_slots) - len(entity_ids):]
+        slots.update(new_slots)
+        self.count += len(entity_ids)
+
+    def reparent_many(self, mapping):
+        """
+        Move a batch of subtrees at once ({entity_id: parent_id}, -1 to
+        detach). Nothing is changed if the result would contain a cycle.
+        """
+        if len(mapping) == 1:
+            # One edge is cheaper moved than rebuilt, O(n) vs O(n log n)
+            (entity_id, parent_id), = mapping.items()
+            self.move(entity_id, parent_id)
+            return
+        slots = self._slots
+        parent = self.parent.copy()
+        for entity_id, parent_id in mapping.items():
+            parent[slots[entity_id]] = -1 if parent_id == -1 else \
+                slots[parent_id]
+        self._rebuild(parent)
+
+    def move(self, entity_id, parent_id=-1):
+        """
+        Move entity_id and its subtree below parent_id (-1 to detach).
+        """
+        slot = self._slots[entity_id]
+        parent_slot = -1 if parent_id == -1 else self._slots[parent_id]
+        if self.parent[slot] == parent_slot:
+            return
+        if parent_slot != -1 and self._is_ancestor(slot, parent_slot):
+            raise ValueError("Cycle in relationtree detected.")
+        self._insert(self._cut(slot), parent_slot)
+
+    def _release(self, slots):
+        for slot in slots.tolist():
+            del self._slots[int(self.entity_id[slot])]
+            self._free_slots.append(slot)
+        self.entity_id[slots] = -1
+        self.parent[slots] = -1
+        self.count -= len(slots)
+        self._invalidate()
+
+    def remove(self, entity_id):
+        """
+        Remove an entity, its children become roots.
+        """
+        slot = self._slots[entity_id]
+        block = self._cut(slot)
+        self._release(block[:1])
+        children = block[1:]
+        if len(children):
+            # The child subtrees stay contiguous, they just lose a level and
+            # get appended as new roots.
+            self.depth[children] -= self.depth[children[0]]
+            tops = children[self.parent[children] == slot]
+            self.parent[tops] = -1
+            position = len(self.preorder)
+            self.preorder = np.concatenate((self.preorder, children))
+            self.tin[children] = np.arange(position, len(self.preorder))
+
+    def remove_many(self, entity_ids):
+        """
+        Remove a batch of entities with a single rebuild, children of
+        removed entities become roots.
+        """
+        slots = np.array([self._slots[entity_id]
+                          for entity_id in set(entity_ids)], dtype=np.intp)
+        if not len(slots):
+            return
+        parent = self.parent.copy()
+        removed = np.zeros(self.capacity + 1, dtype=bool)
+        removed[slots] = True
+        parent[removed[parent]] = -1
+        parent[slots] = -1
+        self._release(slots)
+        self._rebuild(parent)
+
+    def remove_tree(self, entity_id):
+        """
+        Remove an entity and its complete subtree.
+        Returns the removed entity ids.
+        """
+        block = self._cut(self._slots[entity_id])
+        removed = self.entity_id[block].tolist()
+        self._release(block)
+        return removed
+
+    def _is_ancestor(self, ancestor_slot, slot):
+        lo = self.tin[ancestor_slot]
+        return lo <= self.tin[slot] < lo + self.size[ancestor_slot]
+
+    def is_ancestor(self, ancestor_id, entity_id):
+        """
+        True if ancestor_id is entity_id or one of its ancestors.
+        """
+        slots = self._slots
+        return bool(self._is_ancestor(slots[ancestor_id], slots[entity_id]))
+
+    def get_parent(self, entity_id):
+        parent_slot = self.parent[self._slots[entity_id]]
+        return -1 if parent_slot == -1 else int(self.entity_id[parent_slot])
+
+    def get_depth(self, entity_id):
+        return int(self.depth[self._slots[entity_id]])
+
+    def get_subtree_size(self, entity_id):
+        return int(self.size[self._slots[entity_id]])
+
+    def subtree(self, entity_id):
+        """
+        Entity ids of entity_id and its descendants in preorder.
+        """
+        slot = self._slots[entity_id]
+        lo = self.tin[slot]
+        return self.entity_id[self.preorder[lo:lo + self.size[slot]]].tolist()
+
+    def children(self, entity_id):
+        """
+        Direct children of entity_id in preorder, -1 returns the roots.
+        Costs one vectorized pass over the subtree, O(subtree size), so
+        listing the roots is O(n). No per parent child lists are kept;
+        callers needing the roots often should track them themselves.
+        """
+        if entity_id == -1:
+            block = self.preorder
+            slot = -1
+        else:
+            slot = self._slots[entity_id]
+            lo = self.tin[slot]
+            block = self.preorder[lo + 1:lo + self.size[slot]]
+        return self.entity_id[block[self.parent[block] == slot]].tolist()
+
+    def flatten(self):
+        """
+        All entities in preorder, parents before their children.
+        Returns (entity_ids, parent_rows) with parent_rows indexing into
+        entity_ids, -1 for roots.
+        """
+        preorder = self.preorder
+        parents = self.parent[preorder]
+        parent_rows = np.where(parents == -1, -1, self.tin[parents])
+        return self.entity_id[preorder].tolist(), parent_rows
+
+    def _build_sparse(self):
+        depths = self.depth[self.preorder]
+        # Every level stores the preorder position of the minimum depth
+        # within windows of 2**level entries.
+        table = [np.arange(len(depths))]
+        width = 1
+        while width * 2 <= len(depths):
+            last = table[-1]
+            left = last[:-width]
+            right = last[width:]
+            table.append(np.where(depths[left] <= depths[right], left, right))
+            width *= 2
+        self._sparse = (depths, table)
+
+    def _range_min(self, lo, hi):
+        if self._sparse is None:
+            self._build_sparse()
+        depths, table = self._sparse
+        level = (hi - lo).bit_length() - 1
+        left = table[level][lo]
+        right = table[level][hi - (1 << level)]
+        return left if depths[left] <= depths[right] else right
+
+    def lowest_common_ancestor(self, a_id, b_id):
+        """
+        Deepest entity which is an ancestor of both a_id and b_id,
+        or None if they live in different trees.
+        """
+        a = self._slots[a_id]
+        b = self._slots[b_id]
+        if self._is_ancestor(a, b):
+            return a_id
+        if self._is_ancestor(b, a):
+            return b_id
+        if self._sparse is None and self._walked < len(self.preorder):
+            # Right after a change walk up from a, that's O(depth). The
+            # sparse table (O(n log n)) is only rebuilt once the walks
+            # since the last change add up to n steps.
+            parent = self.parent
+            slot = parent[a]
+            steps = 1
+            while slot != -1 and not self._is_ancestor(slot, b):
+                slot = parent[slot]
+                steps += 1
+            self._walked += steps
+            return None if slot == -1 else int(self.entity_id[slot])
+        lo, hi = sorted((int(self.tin[a]), int(self.tin[b])))
+        # The shallowest entity between both (excluding the first) is a
+        # child of the lca, or a root if there is no common ancestor.
+        slot = self.preorder[self._range_min(lo + 1, hi + 1)]
+        parent_slot = self.parent[slot]
+        if parent_slot == -1:
+            return None
+        return int(self.entity_id[parent_slot])
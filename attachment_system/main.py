@@ -1,9 +1,13 @@
+import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
 from kivy.app import App
 from kivy.uix.widget import Widget
-from kivy.uix.treeview import TreeView, TreeViewLabel
 from kivy.clock import Clock
 from kivy.core.window import Window
-from math import radians, degrees
+from math import radians, degrees, cos, sin
+from collections import OrderedDict
+import numpy as np
 import kivent_core
 from kivent_core.gameworld import GameWorld, ObjectProperty
 from kivent_core.managers.resource_managers import texture_manager
@@ -17,7 +21,19 @@ from kivy.factory import Factory
 from kivy.uix.boxlayout import BoxLayout
 from kivy.uix.dropdown import DropDown
 from kivy.uix.button import Button
+from kivy.uix.recycleview import RecycleView
+from kivy.uix.recycleview.views import RecycleDataViewBehavior
+from kivy.uix.recycleboxlayout import RecycleBoxLayout
 from kivy.graphics import Color, Rectangle
+from transforms import TransformForest, apply_affine
+from ancestry import AncestryIndex
+from registry import EntityRegistry
+from demo_utils.spawn_queue import SpawnQueue
+from demo_utils.snapshot import save_snapshot, load_snapshot
+from demo_utils.assets import AssetCatalog
+from demo_utils.session import DemoSession
+from demo_utils.selection import SelectionSet
+from functools import partial
 
 
 class AttachmentSystemDemoAPI():
@@ -27,16 +43,118 @@ class AttachmentSystemDemoAPI():
     You do NOT need to wrap the AttachmentSystems in your code.
     
     The concept is the same for all other "local systems" like LocalPositionSystem2D.
+    
+    With batched_transforms=True the attachment system is paused and the
+    global transforms are computed by a TransformForest instead, which
+    handles the whole forest with a few NumPy operations per frame.
+    Entities have to be registered with track_entity then and
+    update_transforms has to be called once per frame.
+    
+    Entities registered with track_entity are also kept in an
+    AncestryIndex, which answers cycle checks, depth, subtree size and
+    lowest common ancestor queries without walking up the parent chain.
     """
     def __init__(self, gameworld,
                  local_position_system="local_position",
                  local_rotation_system="local_rotate",
-                 attachment_system="attachment"):
+                 attachment_system="attachment",
+                 position_system="position",
+                 rotation_system="rotate",
+                 batched_transforms=False):
         self.local_position_system = local_position_system
         self.local_rotation_system = local_rotation_system
+        self.position_system = position_system
+        self.rotation_system = rotation_system
         self.attachment_system = gameworld.system_manager[attachment_system]
         self.entities = gameworld.entities
         self.gameworld = gameworld
+        self.ancestry = AncestryIndex()
+        self.transforms = None
+        if batched_transforms:
+            self.transforms = TransformForest()
+            self.attachment_system.paused = True
+        
+    def track_entity(self, entity_id):
+        """
+        Register a freshly created entity with the ancestry index
+        and the batched transforms (if enabled).
+        The parent of the entity has to be tracked already.
+        """
+        entity = self.entities[entity_id]
+        parent_id = getattr(entity, self.attachment_system.system_id).parent
+        self.ancestry.add(entity_id, parent_id)
+        if self.transforms is None:
+            return
+        local_position = getattr(entity, self.local_position_system)
+        local_rotation = getattr(entity, self.local_rotation_system)
+        position = getattr(entity, self.position_system)
+        rotation = getattr(entity, self.rotation_system)
+        self.transforms.add(
+            entity_id, parent_id,
+            (local_position.x, local_position.y, local_rotation.r),
+            (position.x, position.y, rotation.r))
+    
+    def track_entities(self, entity_ids):
+        """
+        Same as track_entity for a batch of entities, but the indices are
+        only rebuilt once. Parents may be part of the batch.
+        """
+        entity_ids = list(entity_ids)
+        entities = self.entities
+        attachment_system_id = self.attachment_system.system_id
+        parent_ids = [getattr(entities[entity_id], attachment_system_id).parent
+                      for entity_id in entity_ids]
+        self.ancestry.add_many(entity_ids, parent_ids)
+        if self.transforms is None:
+            return
+        local = []
+        world = []
+        for entity_id in entity_ids:
+            entity = entities[entity_id]
+            local_position = getattr(entity, self.local_position_system)
+            position = getattr(entity, self.position_system)
+            local.append((local_position.x, local_position.y,
+                          getattr(entity, self.local_rotation_system).r))
+            world.append((position.x, position.y,
+                          getattr(entity, self.rotation_system).r))
+        self.transforms.add_many(entity_ids, parent_ids, local, world)
+    
+    def update_transforms(self, dt=None):
+        """
+        Compute the global transforms of all changed subtrees and
+        write them to the global position and rotate components.
+        Entities which did not change (and whose ancestors did not
+        change) are skipped, see recomputed_count.
+        Can be scheduled with Clock.schedule_interval directly.
+        """
+        transforms = self.transforms
+        if transforms is None:
+            return
+        order = transforms.propagate()
+        if not len(order):
+            return
+        entities = self.entities
+        position_system = self.position_system
+        rotation_system = self.rotation_system
+        ids = transforms.entity_id[order].tolist()
+        xs = transforms.world_x[order].tolist()
+        ys = transforms.world_y[order].tolist()
+        rs = transforms.world_r[order].tolist()
+        for entity_id, x, y, r in zip(ids, xs, ys, rs):
+            entity = entities[entity_id]
+            position = getattr(entity, position_system)
+            position.x = x
+            position.y = y
+            getattr(entity, rotation_system).r = r
+    
+    @property
+    def recomputed_count(self):
+        """
+        Number of entities recomputed by the last update_transforms call.
+        """
+        if self.transforms is None:
+            return 0
+        return self.transforms.recomputed
         
     def attach_entity(self, child_id, parent_id):
         """
@@ -51,13 +169,23 @@ class AttachmentSystemDemoAPI():
         # If you create cycles in the children parent relations (a->b->a)
         # the whole subtree (a and b in this case) won't be updated anymore.
         # Normally you'd want to avoid cycles.
-        attachment = getattr(self.entities[parent_id],
-                             self.attachment_system.system_id)
-        if attachment.has_ancestor(child_id):
-            raise ValueError("Cycle in relationtree detected.")
-        # Alternative:
-        #if self.attachment_system.has_ancestor_by_id(parent_id, child_id):            
+        ancestry = self.ancestry
+        if child_id in ancestry and parent_id in ancestry:
+            # O(1) instead of walking up the parents of parent_id.
+            if ancestry.is_ancestor(child_id, parent_id):
+                raise ValueError("Cycle in relationtree detected.")
+        else:
+            attachment = getattr(self.entities[parent_id],
+                                 self.attachment_system.system_id)
+            if attachment.has_ancestor(child_id):
+                raise ValueError("Cycle in relationtree detected.")
+            # Alternative:
+            #if self.attachment_system.has_ancestor_by_id(parent_id, child_id):            
         self.attachment_system.attach_child(parent_id, child_id)
+        if child_id in ancestry and parent_id in ancestry:
+            ancestry.move(child_id, parent_id)
+        if self.transforms is not None:
+            self.transforms.set_parent(child_id, parent_id)
     
     def detach_entity(self, entity_id):
         """
@@ -71,6 +199,62 @@ class AttachmentSystemDemoAPI():
                              self.attachment_system.system_id)
         if not attachment.is_root:
             self.attachment_system.detach_child(entity_id)
+            if entity_id in self.ancestry:
+                self.ancestry.move(entity_id, -1)
+            if self.transforms is not None:
+                self.transforms.set_parent(entity_id, -1)
+    
+    def attach_many(self, pairs):
+        """
+        Attach a batch of (child_id, parent_id) pairs.
+        See reparent_many.
+        """
+        mapping = {}
+        for child_id, parent_id in pairs:
+            if mapping.get(child_id, parent_id) != parent_id:
+                raise ValueError("Entity %i has multiple parents." % child_id)
+            mapping[child_id] = parent_id
+        self.reparent_many(mapping)
+    
+    def detach_many(self, entity_ids):
+        """
+        Detach a batch of entities, see detach_entity.
+        """
+        self.reparent_many(dict.fromkeys(entity_ids, -1))
+    
+    def reparent_many(self, mapping):
+        """
+        Apply a batch of parent changes ({child_id: parent_id}, use -1
+        as parent_id to detach). All entities need to be tracked.
+        
+        The whole batch is validated first. If it would create a cycle
+        a ValueError is raised and nothing is changed.
+        Otherwise the indices are rebuilt once for the whole batch instead
+        of once per entity.
+        """
+        ancestry = self.ancestry
+        for child_id, parent_id in mapping.items():
+            if child_id not in ancestry:
+                raise KeyError(child_id)
+            if parent_id != -1 and parent_id not in ancestry:
+                raise KeyError(parent_id)
+        old_parents = dict((child_id, ancestry.get_parent(child_id))
+                           for child_id in mapping)
+        ancestry.reparent_many(mapping)
+        changed = [(child_id, parent_id)
+                   for child_id, parent_id in mapping.items()
+                   if old_parents[child_id] != parent_id]
+        # Detach everything first, so the attachment system never sees
+        # a temporary cycle while the edges are applied one by one.
+        attachment_system = self.attachment_system
+        for child_id, parent_id in changed:
+            if old_parents[child_id] != -1:
+                attachment_system.detach_child(child_id)
+        for child_id, parent_id in changed:
+            if parent_id != -1:
+                attachment_system.attach_child(parent_id, child_id)
+        if self.transforms is not None:
+            self.transforms.set_parents(dict(changed))
     
     def remove_entity(self, entity_id):
         """
@@ -79,12 +263,90 @@ class AttachmentSystemDemoAPI():
         be detached and become root entities.
         """
         self.gameworld.remove_entity(entity_id)
+        if entity_id in self.ancestry:
+            self.ancestry.remove(entity_id)
+        if self.transforms is not None:
+            self.transforms.remove(entity_id)
     
     def remove_tree(self, entity_id):
         """
         Removes an entity and its complete children tree.
         """
         self.attachment_system.remove_subtree(entity_id)
+        if entity_id in self.ancestry:
+            self.ancestry.remove_tree(entity_id)
+        if self.transforms is not None:
+            self.transforms.remove_tree(entity_id)
+    
+    def remove_many(self, entity_ids):
+        """
+        Remove a batch of entities, like remove_entity. The indices are
+        only rebuilt once.
+        """
+        entity_ids = list(entity_ids)
+        for entity_id in entity_ids:
+            self.gameworld.remove_entity(entity_id)
+        self.ancestry.remove_many([entity_id for entity_id in entity_ids
+                                   if entity_id in self.ancestry])
+        if self.transforms is not None:
+            self.transforms.remove_many(entity_ids)
+    
+    def is_ancestor(self, ancestor_id, entity_id):
+        """
+        True if ancestor_id is entity_id itself or one of its ancestors.
+        Both entities need to be tracked.
+        """
+        return self.ancestry.is_ancestor(ancestor_id, entity_id)
+    
+    def get_depth(self, entity_id):
+        return self.ancestry.get_depth(entity_id)
+    
+    def get_subtree_size(self, entity_id):
+        return self.ancestry.get_subtree_size(entity_id)
+    
+    def lowest_common_ancestor(self, a_id, b_id):
+        """
+        Returns None if both entities are part of different trees.
+        """
+        return self.ancestry.lowest_common_ancestor(a_id, b_id)
+    
+    def get_world_matrix(self, entity_id):
+        """
+        2x3 affine matrix of the world transform of an entity.
+        With batched_transforms the matrix (and its inverse) is cached
+        until the entity or one of its ancestors changes.
+        """
+        if self.transforms is not None and entity_id in self.transforms:
+            return self.transforms.world_matrix(entity_id)
+        # The global components already hold the composed transform,
+        # no need to walk up the parents.
+        entity = self.entities[entity_id]
+        position = getattr(entity, self.position_system)
+        r = getattr(entity, self.rotation_system).r
+        c = cos(r)
+        s = sin(r)
+        return ((c, -s, position.x), (s, c, position.y))
+    
+    def local_to_world(self, entity_id, points):
+        """
+        Convert points (an (n, 2) array or one (x, y) pair) from the
+        local frame of an entity to world coordinates.
+        """
+        if self.transforms is not None and entity_id in self.transforms:
+            return self.transforms.local_to_world(entity_id, points)
+        return apply_affine(np.array(self.get_world_matrix(entity_id)),
+                             points)
+    
+    def world_to_local(self, entity_id, points):
+        """
+        Convert points from world coordinates to the local frame
+        of an entity.
+        """
+        if self.transforms is not None and entity_id in self.transforms:
+            return self.transforms.world_to_local(entity_id, points)
+        (c, _, x), (s, _, y) = self.get_world_matrix(entity_id)
+        inverse = np.array(((c, s, -c * x - s * y), (-s, c, s * x - c * y)))
+        return apply_affine(inverse, points)
     
     def set_local_coordinates(self, entity_id, x, y):
         """
@@ -92,10 +354,12 @@ class AttachmentSystemDemoAPI():
         Just access the local or global system components
         via dot lookup.
         """
-        position = getattr(self.entities[entitiy_id],
+        position = getattr(self.entities[entity_id],
                            self.local_position_system)
         position.x = x 
         position.y = y 
+        if self.transforms is not None:
+            self.transforms.set_local(entity_id, x=x, y=y)
     
     def get_local_coordinates(self, entity_id):
         position = getattr(self.entities[entity_id],
@@ -106,28 +370,155 @@ class AttachmentSystemDemoAPI():
         rotation = getattr(self.entities[entity_id],
                            self.local_rotation_system)
         rotation.r = radians(r)
+        if self.transforms is not None:
+            self.transforms.set_local(entity_id, r=rotation.r)
         
     def get_local_rotation(self, entity_id):
         rotation = getattr(self.entities[entity_id],
                            self.local_rotation_system)
         return degrees(rotation.r)
+
+    def translate_many(self, entity_ids, dx, dy):
+        """
+        Move the local positions of a batch of entities by dx, dy
+        (scalars or one value per entity).
+        """
+        self._offset_local_many(entity_ids, dx, dy, 0.)
+
+    def rotate_many(self, entity_ids, r):
+        """
+        Rotate a batch of entities by r degrees (scalar or one value
+        per entity) relative to their parents.
+        """
+        self._offset_local_many(entity_ids, 0., 0., np.radians(r))
+
+    def _offset_local_many(self, entity_ids, dx, dy, dr):
+        entity_ids = list(entity_ids)
+        if not entity_ids:
+            return
+        transforms = self.transforms
+        if transforms is not None:
+            # Only the forest arrays take part in the math, the local
+            # components just get the results.
+            slots = transforms.offset_local_many(entity_ids, dx, dy, dr)
+            xs = transforms.local_x[slots].tolist()
+            ys = transforms.local_y[slots].tolist()
+            rs = transforms.local_r[slots].tolist()
+        else:
+            n = len(entity_ids)
+            offset = np.column_stack([np.broadcast_to(value, (n, ))
+                                      for value in (dx, dy, dr)])
+            local = np.array([
+                self.get_local_coordinates(entity_id) + (getattr(
+                    self.entities[entity_id], self.local_rotation_system).r, )
+                for entity_id in entity_ids]) + offset
+            xs, ys, rs = local.T.tolist()
+        entities = self.entities
+        local_position_system = self.local_position_system
+        local_rotation_system = self.local_rotation_system
+        for entity_id, x, y, r in zip(entity_ids, xs, ys, rs):
+            entity = entities[entity_id]
+            position = getattr(entity, local_position_system)
+            position.x = x
+            position.y = y
+            getattr(entity, local_rotation_system).r = r
+
+    def entities_in_box(self, x0, y0, x1, y1):
+        """
+        Entity ids whose global position lies inside the box.
+        """
+        if self.transforms is not None:
+            return self.transforms.query_box(x0, y0, x1, y1)
+        entity_ids = self.ancestry.flatten()[0]
+        entities = self.entities
+        inside = []
+        for entity_id in entity_ids:
+            position = getattr(entities[entity_id], self.position_system)
+            if x0 <= position.x <= x1 and y0 <= position.y <= y1:
+                inside.append(entity_id)
+        return inside
+
+    def hierarchy_columns(self):
+        """
+        Parent indices, local and global transforms of all tracked
+        entities as arrays, parents before their children.
+        Returns (entity_ids, columns), see TestGame.save_scene.
+        """
+        entity_ids, parent_rows = self.ancestry.flatten()
+        n = len(entity_ids)
+        local = np.empty((n, 3), dtype=np.float32)
+        position = np.empty((n, 2), dtype=np.float32)
+        rotate = np.empty(n, dtype=np.float32)
+        entities = self.entities
+        for i, entity_id in enumerate(entity_ids):
+            entity = entities[entity_id]
+            local_position = getattr(entity, self.local_position_system)
+            world_position = getattr(entity, self.position_system)
+            local[i] = (local_position.x, local_position.y,
+                        getattr(entity, self.local_rotation_system).r)
+            position[i] = (world_position.x, world_position.y)
+            rotate[i] = getattr(entity, self.rotation_system).r
+        return entity_ids, OrderedDict([
+            ('parent', parent_rows.astype(np.int32)), ('local', local),
+            ('position', position), ('rotate', rotate)])
     
 
+class DropDownOption(object):
+    """
+    One entry of a SimpleDropDown.
+    The option list is virtualized, so options are plain records and
+    only the visible rows have a (recycled) button.
+    """
+    __slots__ = ('text', 'user_data', 'row')
+    
+    def __init__(self, text, user_data, owner):
+        self.text = text
+        self.user_data = user_data
+        # Data dict handed to the RecycleView
+        self.row = {'text': text, 'option': self, 'owner': owner}
+
+
+class SimpleDropDownRow(RecycleDataViewBehavior, Button):
+    option = ObjectProperty(None, allownone=True)
+    owner = ObjectProperty(None, allownone=True)
+    
+    def on_release(self):
+        self.owner._dropdown.select(self.option)
+
+
 class SimpleDropDown(BoxLayout):
     """
     Simple DropDown wrapper to make handling a bit easier.
+    
+    Options are indexed by their user_data, which therefore has to be
+    unique and hashable. Lookups by user_data are O(1) and the list only
+    creates buttons for the rows currently visible.
+    selected holds the selected DropDownOption.
     """
     text = StringProperty("Select one")
     row_height = NumericProperty(44)
+    max_visible_rows = NumericProperty(10)
     main_button = ObjectProperty(None)
     selected = ObjectProperty(None)
     background = ListProperty((1,1,1,1))
     
     def __init__(self, *args, **kwargs):
         super(SimpleDropDown, self).__init__()
+        self._options = OrderedDict()
         self._dropdown = DropDown(size_hint_x=1)
         self.orientation = "vertical"
         self._dropdown.bind(on_select=self._selected)
+        self._list = RecycleView(size_hint=(1, None), height=0,
+                                 viewclass=SimpleDropDownRow)
+        layout = RecycleBoxLayout(orientation='vertical',
+                                  size_hint=(1, None),
+                                  default_size=(None, self.row_height),
+                                  default_size_hint=(1, None))
+        layout.bind(minimum_height=layout.setter('height'))
+        self._list.add_widget(layout)
+        self._dropdown.add_widget(self._list)
+        # Push all option changes of one frame to the list at once.
+        self._refresh_list = Clock.create_trigger(self._update_list)
         with self._dropdown.canvas.before:
             self._background_rect = Color(*self.background)
             self.rect = Rectangle(size=self._dropdown.size,
@@ -138,10 +529,15 @@ class SimpleDropDown(BoxLayout):
         self.rect.pos = instance.pos
         self.rect.size = instance.size        
 
-    def _selected(self, source, widget):
-        if widget != self.selected:
-            self.selected = widget
-            self.main_button.text = widget.text   
+    def _update_list(self, *args):
+        self._list.data = [option.row for option in self._options.values()]
+        self._list.height = self.row_height * min(len(self._options),
+                                                  self.max_visible_rows)
+
+    def _selected(self, source, option):
+        if option != self.selected:
+            self.selected = option
+            self.main_button.text = option.text   
         
     def on_main_button(self, _, value):
         if self.main_button:
@@ -150,58 +546,272 @@ class SimpleDropDown(BoxLayout):
         self.main_button.bind(on_release=self._dropdown.open)
         
     def add_option(self, text, user_data=None):
-        button = Button(text=text, size_hint_y=None, height=self.row_height)
-        button._user_data = user_data
-        button.bind(on_release=self._dropdown.select)
-        self._dropdown.add_widget(button)
+        if user_data in self._options:
+            raise ValueError("Duplicate option %r." % (user_data, ))
+        option = DropDownOption(text, user_data, self)
+        self._options[user_data] = option
+        self._refresh_list()
+        return option
+        
+    def get_option(self, user_data):
+        return self._options.get(user_data)
         
     def find_option(self, value, comparator=None):
-        children = self._dropdown.container.children
-        child = None
-        for child in children:
+        """
+        Find an option by text or with comparator(option, value).
+        This has to scan all options, use get_option if you know
+        the user_data.
+        """
+        for option in self._options.values():
             if comparator:
-                if comparator(child, value):
-                    break
-            elif child.text == value:
-                break
-        else:
-            return None
-        return child
+                if comparator(option, value):
+                    return option
+            elif option.text == value:
+                return option
+        return None
+        
+    def _remove(self, option):
+        if option is None:
+            return
+        del self._options[option.user_data]
+        self._refresh_list()
         
     def remove_option(self, value, comparator=None):
-        child = self.find_option(value, comparator)
-        if child:
-            self._dropdown.remove_widget(child)
+        self._remove(self.find_option(value, comparator))
+            
+    def remove_user_data(self, user_data):
+        self._remove(self._options.get(user_data))
             
     def select_option(self, value, comparator=None):       
-        child = self.find_option(value, comparator)
-        if child:
-            self._dropdown.select(child)
+        option = self.find_option(value, comparator)
+        if option:
+            self._dropdown.select(option)
+            
+    def select_user_data(self, user_data):
+        option = self._options.get(user_data)
+        if option:
+            self._dropdown.select(option)
+
 
+class EntityTreeNode(object):
+    """
+    Node of an EntityTreeView.
+    Nodes are plain records indexed by entity id, the RecycleView only
+    gets rows for the nodes below expanded parents and only creates
+    widgets for the rows on screen. children is an OrderedDict of the
+    child nodes (in insertion order), None for leaves.
+    """
+    __slots__ = ('entity_id', 'text', 'parent', 'children', 'is_open',
+                 'row')
+    
+    def __init__(self, entity_id, text, parent=None):
+        self.entity_id = entity_id
+        self.text = text
+        self.parent = parent
+        self.children = None
+        self.is_open = False
+        self.row = None
 
-def _create_treeview_item(text, user_data=None):
-    item = TreeViewLabel(
-        text=text,
-        is_open=True,
-        size_hint = (None, None)
-        )
-    item._user_data = user_data
-    item.size=item.texture_size
-    item.text_size = item.size
-    item.width = 300 # this is a bit dirty, but how else ?
-    return item
+
+class EntityTreeRow(RecycleDataViewBehavior, BoxLayout):
+    node = ObjectProperty(None, allownone=True)
+    owner = ObjectProperty(None, allownone=True)
+    text = StringProperty('')
+    expander = StringProperty('')
+    depth = NumericProperty(0)
+    selected = BooleanProperty(False)
+
+
+class EntityTreeView(RecycleView):
+    """
+    Lazy hierarchy view for entities.
+    
+    Moving a subtree only touches the old and new parent (siblings are
+    OrderedDicts, so unlinking a node is O(1) no matter how many roots
+    there are), removing a subtree walks the subtree once, and the rows
+    shown are rebuilt once per frame at most.
+    """
+    selected_node = ObjectProperty(None, allownone=True)
+    indent = NumericProperty(16)
+    
+    def __init__(self, **kwargs):
+        super(EntityTreeView, self).__init__(**kwargs)
+        self._nodes = {}
+        self._roots = OrderedDict()
+        # Only scroll to the selection when it changed, not on every
+        # expand / collapse.
+        self._scroll_to_selected = False
+        self._refresh_rows = Clock.create_trigger(self._update_rows)
+        
+    def get_node(self, entity_id):
+        return self._nodes.get(entity_id)
+        
+    def __contains__(self, entity_id):
+        return entity_id in self._nodes
+        
+    def _link(self, node, parent):
+        node.parent = parent
+        if parent is None:
+            self._roots[node] = True
+            return
+        if parent.children is None:
+            parent.children = OrderedDict()
+        parent.children[node] = True
+
+    def _unlink(self, node):
+        parent = node.parent
+        if parent is None:
+            del self._roots[node]
+            return
+        del parent.children[node]
+        if not parent.children:
+            parent.children = None
+        
+    def _visible(self, node):
+        parent = node.parent
+        while parent is not None:
+            if not parent.is_open:
+                return False
+            parent = parent.parent
+        return True
+        
+    def _changed(self, *nodes):
+        # Collapsed parts of the tree have no rows, so changing them
+        # doesn't need a refresh.
+        for node in nodes:
+            if node is None or self._visible(node):
+                self._refresh_rows()
+                return
+        
+    def add_entity(self, entity_id, text, parent_id=-1):
+        if entity_id in self._nodes:
+            raise ValueError("Entity %i is already shown." % entity_id)
+        parent = None if parent_id == -1 else self._nodes[parent_id]
+        node = EntityTreeNode(entity_id, text)
+        self._nodes[entity_id] = node
+        self._link(node, parent)
+        self._changed(parent)
+        return node
+        
+    def move_entity(self, entity_id, parent_id=-1):
+        node = self._nodes[entity_id]
+        parent = None if parent_id == -1 else self._nodes[parent_id]
+        if parent is node.parent:
+            return
+        old_parent = node.parent
+        self._unlink(node)
+        self._link(node, parent)
+        self._changed(old_parent, parent)
+        
+    def remove_entity(self, entity_id):
+        """
+        Remove one node, its children become roots.
+        """
+        node = self._nodes.pop(entity_id)
+        self._changed(node.parent)
+        self._unlink(node)
+        if node.children:
+            for child in node.children:
+                self._link(child, None)
+            node.children = None
+            # New roots are always visible, even if node was not
+            self._refresh_rows()
+        if node is self.selected_node:
+            self.selected_node = None
+        
+    def remove_tree(self, entity_id):
+        """
+        Remove a node and all its descendants.
+        Returns the entity ids of all removed nodes.
+        """
+        node = self._nodes[entity_id]
+        self._changed(node.parent)
+        self._unlink(node)
+        removed = []
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            removed.append(node.entity_id)
+            del self._nodes[node.entity_id]
+            if node is self.selected_node:
+                self.selected_node = None
+            if node.children:
+                stack.extend(node.children)
+        return removed
+        
+    def toggle_node(self, node):
+        node.is_open = not node.is_open
+        if node.children:
+            self._changed(node)
+        
+    def select_node(self, node):
+        """
+        Select a node and expand all its ancestors so it is visible.
+        """
+        parent = node.parent
+        while parent is not None:
+            if not parent.is_open:
+                parent.is_open = True
+            parent = parent.parent
+        self.selected_node = node
+        self._scroll_to_selected = True
+        self._refresh_rows()
         
+    def select_entity(self, entity_id):
+        self.select_node(self._nodes[entity_id])
+        
+    def _update_rows(self, *args):
+        rows = []
+        selected = self.selected_node
+        selected_index = None
+        stack = [(node, 0) for node in reversed(self._roots)]
+        while stack:
+            node, depth = stack.pop()
+            row = node.row
+            if row is None:
+                # Rows are only created once a node becomes visible
+                row = node.row = {'node': node, 'owner': self,
+                                  'text': node.text}
+            row['depth'] = depth * self.indent
+            row['expander'] = ('' if node.children is None else
+                               '-' if node.is_open else '+')
+            row['selected'] = node is selected
+            if node is selected:
+                selected_index = len(rows)
+            rows.append(row)
+            if node.is_open and node.children:
+                stack.extend((child, depth + 1)
+                             for child in reversed(node.children))
+        self.data = rows
+        if self._scroll_to_selected and selected_index is not None and \
+                len(rows) > 1:
+            self.scroll_y = 1. - float(selected_index) / (len(rows) - 1)
+        self._scroll_to_selected = False
+        
+
+# Only the texture names are registered here, the image gets loaded by the
+# first create_entity. python -m demo_utils.assets attachment_system packs
+# the assets into assets/atlas, which is preferred if it exists.
+ASSETS = AssetCatalog(texture_manager)
+ASSETS.discover('assets/atlas', 'assets')
+ENTITY_TEXTURE = 'star3-blue'
 
-texture_manager.load_image('assets/star3-blue.png')
 
+class TestGame(DemoSession, Widget):
+    demo_name = 'attachment_system'
 
-class TestGame(Widget):
     def __init__(self, **kwargs):
         super(TestGame, self).__init__(**kwargs)
-        self.entities = dict()
         self._ent_default_color = (255,255,255,255)
         self._ent_selected_color = (255,0,0,255)
+        # Entity of the primary selected entity, see on_selection_change
         self._selected = None
+        # Edits of the local transform apply to every selected entity.
+        # Highlighting overwrites the color, the original one is kept here.
+        self.selection = SelectionSet()
+        self._unselected_color = {}
+        self.multi_select = False
+        self.spawn_queue = SpawnQueue()
         self.gameworld.init_gameworld(
             ['attachment', 'local_position', 'local_rotate', 'rotate_color_renderer', 'rotate', 'color', 'position'],
             callback=self.init_game)
@@ -209,6 +819,9 @@ class TestGame(Widget):
     def init_game(self):
         self.setup_states()
         self.set_state()
+        # Telemetry, profiler and input recording, see demo_utils.session.
+        # Has to happen before the handlers get bound.
+        self.setup_session()
         gamescreen = self.ids.gamescreenmanager.ids.main_screen
         self.entity_tree = gamescreen.ids.tree_view
         self.entity_dropdown = gamescreen.ids.ent_dropdown
@@ -219,52 +832,96 @@ class TestGame(Widget):
         
         self.demoApi = AttachmentSystemDemoAPI(
             self.gameworld,
-            "local_position", "local_rotate", "attachment")
+            "local_position", "local_rotate", "attachment",
+            batched_transforms=True)
+        # Names and widgets of the entities shown in the UI
+        self.registry = EntityRegistry(self.demoApi.ancestry)
+        # Time every system update, shown in the profile overlay
+        self.profiler.install(['attachment', 'local_position', 'local_rotate',
+                               'rotate_color_renderer', 'rotate', 'color',
+                               'position'])
+        Clock.schedule_interval(
+            self.profiler.wrap('transforms', self.demoApi.update_transforms),
+            0)
                 
         self.entity_tree.bind(selected_node=self.on_tree_node_selected)
+        self.selection.bind(on_change=self.on_selection_change)
         self.txt_local_x.bind(focus=self.on_position_change) 
         self.txt_local_y.bind(focus=self.on_position_change)
         self.slider_rotate.bind(
             value=self.on_rotation_change)
         
-    def create_entity(self, parent_id, local_position):
-        camera = self.gameworld.system_manager['camera1']
+    def create_entity(self, parent_id, local_position, local_rotate=0,
+                      position=None, rotate=0, color=None, track=True):
+        """
+        With track=False the entity is not registered with the demo API,
+        call demoApi.track_entities for a whole batch afterwards.
+        """
+        ASSETS.require(ENTITY_TEXTURE)
+        if position is None:
+            camera = self.gameworld.system_manager['camera1']
+            position = camera.get_camera_center()
         create_component_dict = { 
             'rotate_color_renderer': {
-                'texture': 'star3-blue',
+                'texture': ENTITY_TEXTURE,
                 'size': (50, 50),
                 'render': True
             },
-            'color': self._ent_default_color,
-            'position': camera.get_camera_center(),
-            'rotate': 0,
+            'color': color or self._ent_default_color,
+            'position': position,
+            'rotate': rotate,
             # Create root entities with 'parent':-1 or simply use an empty dict.
             # Like 'attachment': {}
             'attachment': {'parent': parent_id},
             'local_position': local_position, 
-            'local_rotate': 0,
+            'local_rotate': local_rotate,
             }
         component_order = ['rotate', 'color', 
             'position', 'local_position', 'local_rotate', 'rotate_color_renderer', 'attachment']
         entity_id = self.gameworld.init_entity(create_component_dict, component_order)
+        if track:
+            self.demoApi.track_entity(entity_id)
         return entity_id
         
-    def on_add_entity(self):
+    def on_add_entity(self, n=1, priority=0):
         parent = self._selected
         if parent is None:
             parent = -1
-            tree_parent = None
         else:
             parent = parent.entity_id
-            tree_parent = self.entities[parent][1]
-        entity_id = self.create_entity(parent, (25,0), )
-        entity = self.gameworld.entities[entity_id]
-        ent_name = 'Item_%i' % entity_id
-        tree_entry = _create_treeview_item(ent_name, entity_id)
-        self.entity_tree.add_node(tree_entry, tree_parent) 
-        drop_entity = self.entity_dropdown.add_option(ent_name, entity_id)
-        self.entities[entity_id] = (entity, tree_entry, drop_entity)
-        self.entity_tree.select_node(tree_entry)
+        # The entities are created by the spawn queue within its frame
+        # budget, the UI gets updated once they exist.
+        self.spawn_queue.submit(partial(self._spawn_entities, parent), n,
+                                priority, callback=self._add_entities)
+        
+    def _spawn_entities(self, parent, n):
+        if parent != -1 and parent not in self.registry:
+            # The parent got removed while the request was queued
+            parent = -1
+        entity_ids = [self.create_entity(parent, (25,0), track=False)
+                      for _ in range(n)]
+        # One index rebuild per batch instead of one per entity
+        self.demoApi.track_entities(entity_ids)
+        return entity_ids
+        
+    def _add_entities(self, entity_ids):
+        tree_entry = None
+        entities = self.gameworld.entities
+        for entity_id in entity_ids:
+            parent = entities[entity_id].attachment.parent
+            ent_name = 'Item_%i' % entity_id
+            tree_entry = self.entity_tree.add_entity(entity_id, ent_name,
+                                                     parent)
+            drop_entity = self.entity_dropdown.add_option(ent_name, entity_id)
+            self.registry.add(entity_id, ent_name, tree_entry, drop_entity)
+        if tree_entry is not None:
+            self.entity_tree.select_node(tree_entry)
+
+    def find_entity(self, name):
+        """
+        Entity id of the entity called name (e.g. 'Item_3'), or None.
+        """
+        return self.registry.id_of(name)
         
     def on_select_parent(self):
         entity_id = self._selected
@@ -272,45 +929,104 @@ class TestGame(Widget):
             return
         entity_id = entity_id.entity_id
         parent_id = self.entity_dropdown.selected
-        self.demoApi.detach_entity(entity_id)
-        tree_parent = None
-        if not parent_id is None:
-            parent_id = parent_id._user_data
-            if parent_id != -1:
-                self.demoApi.attach_entity(entity_id, parent_id)
-                tree_parent = self.entities[parent_id][1]
-        tree_entry = self.entities[entity_id][1]
-        self.entity_tree.remove_node(tree_entry)
-        self.entity_tree.add_node(tree_entry, tree_parent)      
-        self.entity_tree.select_node(tree_entry)
+        parent_id = -1 if parent_id is None else parent_id.user_data
+        current_parent_id = self.demoApi.ancestry.get_parent(entity_id)
+        if parent_id == current_parent_id:
+            return
+        try:
+            self.demoApi.reparent_many({entity_id: parent_id})
+        except ValueError:
+            # The entity itself or one of its descendants was chosen,
+            # refuse it and show the actual parent again.
+            self.entity_dropdown.select_user_data(current_parent_id)
+            return
+        self.entity_tree.move_entity(entity_id, parent_id)
+        self.entity_tree.select_entity(entity_id)
         
     def on_position_change(self, instance, value):
         if value: # skip got focus
             return
         if self._selected is None:
             return
-        entity = self._selected
+        entity_id = self._selected.entity_id
+        old_x, old_y = x, y = self.demoApi.get_local_coordinates(entity_id)
         if instance == self.txt_local_x:
-            entity.local_position.x = int(self.txt_local_x.text)
+            x = int(self.txt_local_x.text)
+        else:
+            y = int(self.txt_local_y.text)
+        if len(self.selection) > 1:
+            # Move the whole selection along with the shown entity
+            self.demoApi.translate_many(self.selection, x - old_x, y - old_y)
         else:
-            entity.local_position.y = int(self.txt_local_y.text)
+            self.demoApi.set_local_coordinates(entity_id, x, y)
         
     def on_rotation_change(self, instance, value):
         if self._selected is None:
             return
         entity = self._selected
-        self.demoApi.set_local_rotation(entity.entity_id, value)
+        if len(self.selection) > 1:
+            delta = value - self.demoApi.get_local_rotation(entity.entity_id)
+            if delta:
+                self.demoApi.rotate_many(self.selection, delta)
+        else:
+            self.demoApi.set_local_rotation(entity.entity_id, value)
         
+    def set_multi_select(self, enabled):
+        """
+        While enabled, selecting tree nodes adds to the selection.
+        """
+        self.multi_select = enabled
+
     def on_tree_node_selected(self, _, node):
         if node is None: return
-        entity_id = node._user_data
-        entity = self.entities[entity_id][0]
-        if entity == self._selected:
+        if self.multi_select:
+            self.selection.add(node.entity_id)
+        else:
+            self.selection.replace([node.entity_id])
+
+    def select_visible(self):
+        """
+        Select every entity within the camera view.
+        """
+        gameview = self.gameworld.system_manager['camera1']
+        scale = gameview.camera_scale
+        x0, y0 = -gameview.camera_pos[0], -gameview.camera_pos[1]
+        x1 = x0 + gameview.size[0] * scale
+        y1 = y0 + gameview.size[1] * scale
+        self.selection.replace(self.demoApi.entities_in_box(x0, y0, x1, y1))
+
+    def select_subtree(self):
+        """
+        Select the primary entity and all its descendants.
+        """
+        if self._selected is None:
             return
+        entity_id = self._selected.entity_id
+        subtree = self.demoApi.ancestry.subtree(entity_id)
+        # Keep the shown entity primary
+        self.selection.replace(subtree[1:] + [entity_id])
+
+    def on_selection_change(self, selection, added, removed):
+        entities = self.gameworld.entities
+        registry = self.registry
+        unselected_color = self._unselected_color
         # Restore old highlights
-        if not self._selected is None:
-            self._selected.color.rgb = self._ent_default_color 
-        entity.color.rgb = self._ent_selected_color
+        for entity_id in removed:
+            rgba = unselected_color.pop(entity_id)
+            if entity_id in registry:
+                entities[entity_id].color.rgba = rgba
+        for entity_id in added:
+            color = entities[entity_id].color
+            unselected_color[entity_id] = tuple(color.rgba)
+            color.rgba = self._ent_selected_color
+        entity_id = selection.primary
+        if entity_id is None:
+            self._selected = None
+            return
+        if self._selected is not None and \
+                self._selected.entity_id == entity_id:
+            return
+        entity = entities[entity_id]
         # and update labels
         self._selected = entity
         x, y = self.demoApi.get_local_coordinates(entity_id)
@@ -318,34 +1034,121 @@ class TestGame(Widget):
         self.txt_local_y.text = "%i" % y
         self.slider_rotate.value = self.demoApi.get_local_rotation(entity_id)
         parent_id = entity.attachment.parent
-        self.entity_dropdown.select_option(
-            parent_id, comparator=lambda n,v: n._user_data == v)
-        self.entity_tree.select_node(node) # Restore selected state on tree
+        self.entity_dropdown.select_user_data(parent_id)
         
     def on_remove_entity(self):
         entity = self._selected
         if entity is None: return
-        for child in entity.attachment.children:
-            tree_entry = self.entities[child][1]
-            self.entity_tree.remove_node(tree_entry)
-            self.entity_tree.add_node(tree_entry)
-        self.entity_tree.remove_node(self.entities[entity.entity_id][1])
-        self._selected = None
-        del self.entities[entity.entity_id]
+        self.selection.discard(entity.entity_id)
+        # Children become roots, just like in the attachment system.
+        self.entity_tree.remove_entity(entity.entity_id)
+        self.entity_dropdown.remove_user_data(entity.entity_id)
+        self.registry.remove(entity.entity_id)
         self.demoApi.remove_entity(entity.entity_id)
         
     def on_remove_entity_tree(self):
         entity = self._selected
         if entity is None: return
-        for child in entity.attachment.children:
-            tree_entry = self.entities[child][1]
-            self.entity_tree.remove_node(tree_entry)
-            del self.entities[child]
-        self.entity_tree.remove_node(self.entities[entity.entity_id][1])
-        self._selected = None
-        del self.entities[entity.entity_id]
+        # Clean up the whole subtree, not only the direct children.
+        removed = [record.entity_id for record in
+                   self.registry.remove_tree(entity.entity_id)]
+        self.selection.discard_many(removed)
+        self.entity_tree.remove_tree(entity.entity_id)
+        for entity_id in removed:
+            self.entity_dropdown.remove_user_data(entity_id)
         self.demoApi.remove_tree(entity.entity_id)
+        # The attachment system removes the subtree on its own
+        for entity_id in removed:
+            self.telemetry.forget(entity_id)
+    
+    def remove_selection(self):
+        """
+        Remove all selected entities, their children become roots.
+        """
+        entity_ids = self.selection.entity_ids
+        if not entity_ids:
+            return
+        self.selection.clear()
+        for entity_id in entity_ids:
+            self.entity_tree.remove_entity(entity_id)
+            self.entity_dropdown.remove_user_data(entity_id)
+        self.registry.remove_many(entity_ids)
+        self.demoApi.remove_many(entity_ids)
     
+    def save_scene(self, path):
+        """
+        Write the whole hierarchy (parents, local and global transforms
+        and colors) to a snapshot file, see demo_utils.snapshot.
+        """
+        entity_ids, columns = self.demoApi.hierarchy_columns()
+        entities = self.gameworld.entities
+        color = np.empty((len(entity_ids), 4), dtype=np.uint8)
+        for i, entity_id in enumerate(entity_ids):
+            color[i] = entities[entity_id].color.rgba
+        # Don't persist the selection highlight
+        unselected_color = self._unselected_color
+        for i, entity_id in enumerate(entity_ids):
+            if entity_id in unselected_color:
+                color[i] = unselected_color[entity_id]
+        columns['color'] = color
+        save_snapshot(path, columns, meta={'demo': 'attachment_system'})
+
+    def load_scene(self, path):
+        """
+        Add the hierarchy of a snapshot file written by save_scene,
+        next to the existing entities. Returns the new entity ids.
+        """
+        snapshot = load_snapshot(path)
+        parent_rows = snapshot['parent'].tolist()
+        local = snapshot['local'].tolist()
+        position = snapshot['position'].tolist()
+        rotate = snapshot['rotate'].tolist()
+        color = [tuple(rgba) for rgba in snapshot['color'].tolist()]
+        create_entity = self.create_entity
+        entity_ids = []
+        # Rows are in preorder, so parents are always created first
+        for row, parent_row in enumerate(parent_rows):
+            parent_id = -1 if parent_row == -1 else entity_ids[parent_row]
+            x, y, r = local[row]
+            entity_ids.append(create_entity(
+                parent_id, (x, y), r, tuple(position[row]), rotate[row],
+                color[row], track=False))
+        self.demoApi.track_entities(entity_ids)
+        self._add_entities(entity_ids)
+        return entity_ids
+
+    def input_channels(self):
+        """
+        The handlers recorded by start_recording, see demo_utils.replay.
+        Selections are replayed through the widgets, which call the
+        handlers just like a user would.
+        """
+        def encode_node(_, node):
+            return None if node is None else node.entity_id
+
+        def replay_node(game, entity_id):
+            if entity_id is not None:
+                game.entity_tree.select_entity(entity_id)
+
+        def encode_parent():
+            option = self.entity_dropdown.selected
+            return -1 if option is None else option.user_data
+
+        def replay_parent(game, parent_id):
+            game.entity_dropdown.select_user_data(parent_id)
+
+        return {
+            'on_add_entity': (None, None),
+            'on_tree_node_selected': (encode_node, replay_node),
+            'on_select_parent': (encode_parent, replay_parent),
+            'on_remove_entity': (None, None),
+            'on_remove_entity_tree': (None, None),
+            'set_multi_select': (None, None),
+            'select_visible': (None, None),
+            'select_subtree': (None, None),
+            'remove_selection': (None, None),
+        }
+
     def setup_states(self):
         self.gameworld.add_state(state_name='main', 
             systems_added=['rotate_color_renderer'],
@@ -358,7 +1161,21 @@ class TestGame(Widget):
 
     
 class YourAppNameApp(App):
-    pass
+    profile_text = StringProperty('')
+    scene_path = StringProperty('scene.kvsnap')
+    
+    def __init__(self, **kwargs):
+        App.__init__(self, **kwargs)
+        Clock.schedule_interval(self.update_stats, .5)
+        
+    def update_stats(self, dt):
+        if hasattr(self.root, 'profiler'):
+            self.profile_text = self.root.profiler.format_table()
+            
+    def on_stop(self):
+        # PROFILE_EXPORT, RECORD_INPUT and ZONE_REPORT, see
+        # demo_utils.session
+        self.root.finish_session()
 
 
 if __name__ == '__main__':
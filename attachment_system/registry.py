@@ -0,0 +1,97 @@
+"""
+Bookkeeping for the entities shown by the demo UI.
+
+Every entity gets one EntityRecord (a __slots__ record, no per instance
+dict) holding its name and the tree node and dropdown option showing it.
+Records are indexed by entity id and by name, so both lookups are dict
+lookups instead of scans over widgets.
+
+The hierarchy itself is not copied: parents, children and subtrees come
+from the AncestryIndex the demo API keeps anyway, which answers them
+without walking the tree in Python.
+"""
+
+
+class EntityRecord(object):
+    __slots__ = ('entity_id', 'name', 'tree_node', 'option')
+
+    def __init__(self, entity_id, name, tree_node=None, option=None):
+        self.entity_id = entity_id
+        self.name = name
+        self.tree_node = tree_node
+        self.option = option
+
+
+class EntityRegistry(object):
+    """
+    Entity ids and names have to be unique. hierarchy is the
+    AncestryIndex the entities are tracked in, entities have to be
+    tracked there before they get registered.
+    """
+    def __init__(self, hierarchy):
+        self.hierarchy = hierarchy
+        self._records = {}
+        self._by_name = {}
+
+    def __len__(self):
+        return len(self._records)
+
+    def __contains__(self, entity_id):
+        return entity_id in self._records
+
+    def __getitem__(self, entity_id):
+        return self._records[entity_id]
+
+    def __iter__(self):
+        return iter(list(self._records))
+
+    def get(self, entity_id):
+        return self._records.get(entity_id)
+
+    def id_of(self, name):
+        """
+        Entity id of the entity called name, None if there is none.
+        """
+        return self._by_name.get(name)
+
+    def parent_of(self, entity_id):
+        return self.hierarchy.get_parent(entity_id)
+
+    def children_of(self, parent_id):
+        """
+        Entity ids of the direct children of parent_id (-1 for roots).
+        This scans the subtree of parent_id, O(subtree size); for -1
+        that is every entity. The tree view keeps its own root nodes
+        instead of asking for -1 here.
+        """
+        return self.hierarchy.children(parent_id)
+
+    def add(self, entity_id, name, tree_node=None, option=None):
+        if entity_id in self._records:
+            raise ValueError("Entity %i is already registered." % entity_id)
+        if name in self._by_name:
+            raise ValueError("Duplicate entity name %r." % (name, ))
+        record = EntityRecord(entity_id, name, tree_node, option)
+        self._records[entity_id] = record
+        self._by_name[name] = entity_id
+        return record
+
+    def remove(self, entity_id):
+        """
+        Remove the record of an entity and return it.
+        """
+        record = self._records.pop(entity_id)
+        del self._by_name[record.name]
+        return record
+
+    def remove_many(self, entity_ids):
+        return [self.remove(entity_id) for entity_id in entity_ids]
+
+    def remove_tree(self, entity_id):
+        """
+        Remove the records of an entity and all its descendants, parents
+        first. Has to be called before the subtree leaves the hierarchy.
+        """
+        return [self.remove(child_id) for child_id in
+                self.hierarchy.subtree(entity_id)
+                if child_id in self._records]
@@ -0,0 +1,212 @@
+"""
+Checks AncestryIndex against a plain dict of parents.
+
+    python -m pytest attachment_system
+"""
+import numpy as np
+import pytest
+from ancestry import AncestryIndex
+
+
+class ReferenceHierarchy(object):
+    """
+    The same edits as AncestryIndex, answered by walking parent chains.
+    """
+    def __init__(self):
+        self.parents = {}
+
+    def chain(self, entity_id):
+        """
+        entity_id and its ancestors, entity_id first.
+        """
+        chain = [entity_id]
+        while self.parents[chain[-1]] != -1:
+            chain.append(self.parents[chain[-1]])
+        return chain
+
+    def is_ancestor(self, ancestor_id, entity_id):
+        return ancestor_id in self.chain(entity_id)
+
+    def depth(self, entity_id):
+        return len(self.chain(entity_id)) - 1
+
+    def subtree(self, entity_id):
+        return set(child_id for child_id in self.parents
+                   if self.is_ancestor(entity_id, child_id))
+
+    def children(self, parent_id):
+        return sorted(child_id for child_id, other in self.parents.items()
+                      if other == parent_id)
+
+    def lowest_common_ancestor(self, a_id, b_id):
+        ancestors = set(self.chain(a_id))
+        for entity_id in self.chain(b_id):
+            if entity_id in ancestors:
+                return entity_id
+        return None
+
+    def has_cycle(self, parents):
+        for entity_id in parents:
+            seen = set()
+            while entity_id != -1:
+                if entity_id in seen:
+                    return True
+                seen.add(entity_id)
+                entity_id = parents[entity_id]
+        return False
+
+    def remove(self, entity_id):
+        del self.parents[entity_id]
+        for child_id, parent_id in self.parents.items():
+            if parent_id == entity_id:
+                self.parents[child_id] = -1
+
+
+def random_forest(rng, n):
+    entity_ids = []
+    parent_ids = []
+    for entity_id in range(n):
+        parent_id = -1
+        if entity_ids and rng.rand() < .85:
+            parent_id = entity_ids[rng.randint(len(entity_ids))]
+        entity_ids.append(entity_id)
+        parent_ids.append(parent_id)
+    return entity_ids, parent_ids
+
+
+def build(rng, n, batched):
+    index = AncestryIndex(capacity=4)
+    reference = ReferenceHierarchy()
+    entity_ids, parent_ids = random_forest(rng, n)
+    if batched:
+        # Children before their parents, add_many has to sort that out
+        order = rng.permutation(n)
+        index.add_many([entity_ids[i] for i in order],
+                       [parent_ids[i] for i in order])
+    else:
+        for entity_id, parent_id in zip(entity_ids, parent_ids):
+            index.add(entity_id, parent_id)
+    reference.parents.update(zip(entity_ids, parent_ids))
+    return index, reference
+
+
+def assert_same(index, reference, rng, pairs=40):
+    entity_ids = list(reference.parents)
+    assert len(index) == len(entity_ids)
+    for entity_id in entity_ids:
+        assert entity_id in index
+        assert index.get_parent(entity_id) == reference.parents[entity_id]
+        assert index.get_depth(entity_id) == reference.depth(entity_id)
+        subtree = index.subtree(entity_id)
+        assert subtree[0] == entity_id
+        assert set(subtree) == reference.subtree(entity_id)
+        assert index.get_subtree_size(entity_id) == len(subtree)
+        assert sorted(index.children(entity_id)) == \
+            reference.children(entity_id)
+    assert sorted(index.children(-1)) == reference.children(-1)
+    # Preorder: every parent comes before its children
+    flat_ids, parent_rows = index.flatten()
+    assert sorted(flat_ids) == sorted(entity_ids)
+    for row, parent_row in enumerate(parent_rows.tolist()):
+        expected = reference.parents[flat_ids[row]]
+        if expected == -1:
+            assert parent_row == -1
+        else:
+            assert -1 < parent_row < row
+            assert flat_ids[parent_row] == expected
+    # Enough queries to go through the parent chain walks as well as the
+    # sparse table built once they add up.
+    for _ in range(pairs):
+        a_id, b_id = rng.choice(entity_ids, 2).tolist()
+        assert index.is_ancestor(a_id, b_id) == \
+            reference.is_ancestor(a_id, b_id)
+        assert index.lowest_common_ancestor(a_id, b_id) == \
+            reference.lowest_common_ancestor(a_id, b_id)
+
+
+def random_mapping(rng, reference, size):
+    entity_ids = list(reference.parents)
+    mapping = {}
+    for entity_id in rng.choice(entity_ids, size).tolist():
+        mapping[entity_id] = -1 if rng.rand() < .2 else \
+            entity_ids[rng.randint(len(entity_ids))]
+    return mapping
+
+
+@pytest.mark.parametrize('seed', range(10))
+@pytest.mark.parametrize('batched', [False, True])
+def test_random_edits_match_reference(seed, batched):
+    rng = np.random.RandomState(seed)
+    index, reference = build(rng, 50, batched)
+    assert_same(index, reference, rng)
+    next_id = 50
+    for step in range(30):
+        entity_ids = list(reference.parents)
+        entity_id = entity_ids[rng.randint(len(entity_ids))]
+        edit = rng.randint(7)
+        if edit == 0:
+            parent_id = entity_ids[rng.randint(len(entity_ids))]
+            if reference.is_ancestor(entity_id, parent_id):
+                with pytest.raises(ValueError):
+                    index.move(entity_id, parent_id)
+            else:
+                index.move(entity_id, parent_id)
+                reference.parents[entity_id] = parent_id
+        elif edit == 1:
+            # One edge (a plain move) or a batch, cycles are refused as a
+            # whole.
+            mapping = random_mapping(rng, reference,
+                                     1 if rng.rand() < .5 else 4)
+            parents = dict(reference.parents)
+            parents.update(mapping)
+            if reference.has_cycle(parents):
+                with pytest.raises(ValueError):
+                    index.reparent_many(mapping)
+            else:
+                index.reparent_many(mapping)
+                reference.parents = parents
+        elif edit == 2 and len(entity_ids) > 1:
+            index.remove(entity_id)
+            reference.remove(entity_id)
+        elif edit == 3 and len(entity_ids) > 4:
+            removed = rng.choice(entity_ids, 3).tolist()
+            index.remove_many(removed)
+            for removed_id in set(removed):
+                reference.remove(removed_id)
+        elif edit == 4 and len(reference.subtree(entity_id)) < \
+                len(entity_ids):
+            subtree = reference.subtree(entity_id)
+            assert set(index.remove_tree(entity_id)) == subtree
+            for removed_id in subtree:
+                del reference.parents[removed_id]
+        elif edit == 5:
+            new_ids = list(range(next_id, next_id + 5))
+            # Parents from the tree and from the batch itself
+            parent_ids = [entity_id, -1, next_id, next_id + 4, next_id + 1]
+            index.add_many(new_ids, parent_ids)
+            reference.parents.update(zip(new_ids, parent_ids))
+            next_id += 5
+        else:
+            index.add(next_id, entity_id)
+            reference.parents[next_id] = entity_id
+            next_id += 1
+        assert_same(index, reference, rng)
+
+
+def test_rejected_edits_change_nothing():
+    index = AncestryIndex()
+    parent_ids = [-1, 0, 1, 2, -1, -1]
+    index.add_many(range(6), parent_ids)
+    with pytest.raises(ValueError):
+        index.move(0, 3)
+    with pytest.raises(ValueError):
+        index.reparent_many({0: 3})
+    with pytest.raises(ValueError):
+        # Each edge alone is fine, together they form a cycle
+        index.reparent_many({4: 5, 5: 4})
+    with pytest.raises(ValueError):
+        index.add_many([6, 7], [7, 6])
+    assert [index.get_parent(entity_id) for entity_id in range(6)] == \
+        parent_ids
+    assert index.subtree(0) == [0, 1, 2, 3]
+    assert 6 not in index and len(index) == 6
@@ -0,0 +1,187 @@
+"""
+Checks TransformForest against a straightforward per entity propagation.
+
+    python -m pytest attachment_system
+"""
+from math import cos, sin
+import numpy as np
+import pytest
+from transforms import TransformForest
+
+
+def propagate_reference(parents, local, world):
+    """
+    parents maps entity id -> parent id (-1 for roots), local and world map
+    entity id -> (x, y, r). Returns a new dict with the world transforms,
+    roots keep their world values.
+    """
+    result = {}
+    for entity_id in parents:
+        chain = []
+        while entity_id not in result and parents[entity_id] != -1:
+            chain.append(entity_id)
+            entity_id = parents[entity_id]
+        if entity_id not in result:
+            result[entity_id] = tuple(world[entity_id])
+        px, py, pr = result[entity_id]
+        for entity_id in reversed(chain):
+            x, y, r = local[entity_id]
+            px, py, pr = (px + x * cos(pr) - y * sin(pr),
+                          py + x * sin(pr) + y * cos(pr),
+                          pr + r)
+            result[entity_id] = (px, py, pr)
+    return result
+
+
+class ReferenceForest(object):
+    """
+    The same edits as TransformForest on plain dicts. Like the forest,
+    entities that become roots keep the world transform of the last
+    propagate().
+    """
+    def __init__(self):
+        self.parents = {}
+        self.local = {}
+        self.world = {}
+
+    def add(self, entity_id, parent_id, local, world):
+        self.parents[entity_id] = parent_id
+        self.local[entity_id] = tuple(local)
+        self.world[entity_id] = tuple(world)
+
+    def is_ancestor(self, ancestor_id, entity_id):
+        while entity_id != -1:
+            if entity_id == ancestor_id:
+                return True
+            entity_id = self.parents[entity_id]
+        return False
+
+    def set_parent(self, entity_id, parent_id):
+        self.parents[entity_id] = parent_id
+
+    def remove(self, entity_id):
+        del self.parents[entity_id]
+        del self.local[entity_id]
+        del self.world[entity_id]
+        for child_id, parent_id in self.parents.items():
+            if parent_id == entity_id:
+                self.parents[child_id] = -1
+
+    def subtree(self, entity_id):
+        return [child_id for child_id in self.parents
+                if self.is_ancestor(entity_id, child_id)]
+
+    def propagate(self):
+        self.world = propagate_reference(self.parents, self.local,
+                                         self.world)
+        return self.world
+
+
+def random_transform(rng):
+    return (rng.uniform(-100, 100), rng.uniform(-100, 100),
+            rng.uniform(-np.pi, np.pi))
+
+
+def build(rng, n, batched):
+    forest = TransformForest(capacity=4)
+    reference = ReferenceForest()
+    entity_ids = []
+    parent_ids = []
+    for entity_id in range(n):
+        parent_id = -1
+        if entity_ids and rng.rand() < .8:
+            parent_id = entity_ids[rng.randint(len(entity_ids))]
+        entity_ids.append(entity_id)
+        parent_ids.append(parent_id)
+    local = [random_transform(rng) for _ in entity_ids]
+    world = [random_transform(rng) for _ in entity_ids]
+    if batched:
+        # Children before their parents, add_many has to sort that out
+        order = rng.permutation(n)
+        forest.add_many([entity_ids[i] for i in order],
+                        [parent_ids[i] for i in order],
+                        [local[i] for i in order], [world[i] for i in order])
+    else:
+        for args in zip(entity_ids, parent_ids, local, world):
+            forest.add(*args)
+    for args in zip(entity_ids, parent_ids, local, world):
+        reference.add(*args)
+    return forest, reference
+
+
+def assert_same(forest, reference):
+    forest.propagate()
+    expected = reference.propagate()
+    assert len(forest) == len(expected)
+    for entity_id, transform in expected.items():
+        np.testing.assert_allclose(forest.get_world(entity_id), transform,
+                                   rtol=1e-9, atol=1e-6)
+
+
+@pytest.mark.parametrize('seed', range(10))
+@pytest.mark.parametrize('batched', [False, True])
+def test_random_edits_match_reference(seed, batched):
+    rng = np.random.RandomState(seed)
+    forest, reference = build(rng, 60, batched)
+    assert_same(forest, reference)
+    next_id = 60
+    for step in range(40):
+        # A few edits between two propagate() calls
+        for _ in range(rng.randint(1, 6)):
+            entity_ids = list(reference.parents)
+            entity_id = entity_ids[rng.randint(len(entity_ids))]
+            edit = rng.randint(5)
+            if edit == 0:
+                x, y, r = random_transform(rng)
+                forest.set_local(entity_id, x=x, y=y, r=r)
+                reference.local[entity_id] = (x, y, r)
+            elif edit == 1:
+                parent_id = entity_ids[rng.randint(len(entity_ids))]
+                if rng.rand() < .2 or reference.is_ancestor(entity_id,
+                                                            parent_id):
+                    parent_id = -1
+                forest.set_parent(entity_id, parent_id)
+                reference.set_parent(entity_id, parent_id)
+            elif edit == 2 and len(entity_ids) > 1:
+                forest.remove(entity_id)
+                reference.remove(entity_id)
+            elif edit == 3 and len(reference.subtree(entity_id)) < \
+                    len(entity_ids):
+                subtree = reference.subtree(entity_id)
+                assert sorted(forest.subtree(entity_id)) == sorted(subtree)
+                forest.remove_tree(entity_id)
+                for child_id in subtree:
+                    reference.remove(child_id)
+            else:
+                local = random_transform(rng)
+                world = random_transform(rng)
+                forest.add(next_id, entity_id, local, world)
+                reference.add(next_id, entity_id, local, world)
+                next_id += 1
+        assert_same(forest, reference)
+
+
+def test_unchanged_frames_recompute_nothing():
+    forest, reference = build(np.random.RandomState(0), 30, False)
+    forest.propagate()
+    assert not len(forest.propagate())
+    assert forest.recomputed == 0
+
+
+def test_world_matrices_are_copies():
+    forest = TransformForest()
+    forest.add(0, world=(10., 20., .5))
+    forest.add(1, 0, local=(3., 4., .25))
+    forest.propagate()
+    matrix = forest.world_matrix(1)
+    expected = matrix.copy()
+    matrix[:] = 0.
+    forest.inverse_world_matrix(1)[:] = 0.
+    np.testing.assert_allclose(forest.world_matrix(1), expected)
+    point = forest.local_to_world(1, (1., 2.))
+    np.testing.assert_allclose(forest.world_to_local(1, point), (1., 2.))
+    held = forest.world_matrix(1)
+    forest.set_local(1, x=7.)
+    forest.propagate()
+    np.testing.assert_allclose(held, expected)
+    assert not np.allclose(forest.world_matrix(1), expected)
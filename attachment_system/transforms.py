@@ -0,0 +1,468 @@
+"""
+Array backed transform propagation for attachment hierarchies.
+
+LocalPositionRotateSystem2D walks every attached entity in Python (well,
+Cython) and turns its local position / rotation into the global one.
+TransformForest keeps the same forest as flat NumPy arrays instead:
+
+- every entity owns a slot in the ``local_*`` / ``world_*`` arrays
+- ``parent`` holds the parent slot of every slot (-1 for roots)
+- ``order`` lists all used slots sorted by depth, so every parent comes
+  before its children (topological order)
+
+The global transforms are then computed level by level with a handful of
+vectorized array operations, no matter how many entities are attached.
+Every change marks the touched slot as dirty, propagate() pushes the dirty
+flags down the hierarchy and only recomputes the dirty subtrees. Frames
+without any change return right away.
+
+Every recomputed slot also gets its ``version`` bumped, which invalidates
+the cached world matrices (and their inverses) used by local_to_world and
+world_to_local.
+
+The math is the one LocalPositionRotateSystem2D uses::
+
+    world_r = parent_world_r + local_r
+    world_x = parent_world_x + local_x * cos(parent_world_r)
+                             - local_y * sin(parent_world_r)
+    world_y = parent_world_y + local_x * sin(parent_world_r)
+                             + local_y * cos(parent_world_r)
+
+Root entities keep their world values, their local values are ignored.
+"""
+import numpy as np
+
+_TRANSFORM_ARRAYS = ('local_x', 'local_y', 'local_r',
+                     'world_x', 'world_y', 'world_r')
+
+
+def forest_depths(parent, used):
+    """
+    Depth of every used slot of a parent index array (-1 for unused slots).
+    Uses pointer jumping, so this takes O(log(depth)) vectorized passes.
+    Raises ValueError if the parents contain a cycle.
+    """
+    parent = np.where(used, parent, -1)
+    depth = (parent >= 0).astype(np.intp)
+    jump = parent.copy()
+    # Every pass doubles the distance covered by jump, so after
+    # log2(n) + 1 passes everything not sitting on a cycle reached a root.
+    for _ in range(max(1, len(parent)).bit_length() + 1):
+        active = np.flatnonzero(jump >= 0)
+        if not len(active):
+            break
+        target = jump[active]
+        depth[active] += depth[target]
+        jump[active] = jump[target]
+    else:
+        raise ValueError("Cycle in relationtree detected.")
+    depth[~used] = -1
+    return depth
+
+
+class TransformForest(object):
+    """
+    Parent index arrays for a forest of 2d transforms.
+    Entities are addressed by their entity id, slots are an
+    implementation detail and may be reused after an entity got removed.
+    """
+    def __init__(self, capacity=256):
+        self.capacity = 0
+        self.count = 0
+        self._slots = {}
+        self._free_slots = []
+        self._order = np.zeros(0, dtype=np.intp)
+        self._levels = []
+        self._needs_reindex = False
+        self._any_dirty = False
+        # Number of slots recomputed by the last / all propagate() calls.
+        self.recomputed = 0
+        self.total_recomputed = 0
+        self.entity_id = np.empty(0, dtype=np.intp)
+        self.parent = np.empty(0, dtype=np.intp)
+        self.depth = np.empty(0, dtype=np.intp)
+        self.used = np.empty(0, dtype=bool)
+        self.dirty = np.empty(0, dtype=bool)
+        for name in _TRANSFORM_ARRAYS:
+            setattr(self, name, np.empty(0, dtype=np.float64))
+        self.version = np.empty(0, dtype=np.int64)
+        # Composed 2x3 affine matrices, valid while *_version == version.
+        self._matrix = np.empty((0, 2, 3), dtype=np.float64)
+        self._matrix_version = np.empty(0, dtype=np.int64)
+        self._inverse = np.empty((0, 2, 3), dtype=np.float64)
+        self._inverse_version = np.empty(0, dtype=np.int64)
+        self._grow(max(1, capacity))
+
+    def _grow(self, capacity):
+        old = self.capacity
+
+        def resize(array, fill):
+            new = np.empty((capacity,) + array.shape[1:], dtype=array.dtype)
+            new[:old] = array[:old]
+            new[old:] = fill
+            return new
+
+        self.entity_id = resize(self.entity_id, -1)
+        self.parent = resize(self.parent, -1)
+        self.used = resize(self.used, False)
+        self.dirty = resize(self.dirty, False)
+        for name in _TRANSFORM_ARRAYS:
+            setattr(self, name, resize(getattr(self, name), 0.))
+        self.version = resize(self.version, 0)
+        self._matrix = resize(self._matrix, 0.)
+        self._matrix_version = resize(self._matrix_version, -1)
+        self._inverse = resize(self._inverse, 0.)
+        self._inverse_version = resize(self._inverse_version, -1)
+        self._free_slots.extend(range(capacity - 1, old - 1, -1))
+        self.capacity = capacity
+
+    def __len__(self):
+        return self.count
+
+    def __contains__(self, entity_id):
+        return entity_id in self._slots
+
+    def slot_of(self, entity_id):
+        return self._slots[entity_id]
+
+    def add(self, entity_id, parent_id=-1, local=(0., 0., 0.),
+            world=(0., 0., 0.)):
+        """
+        Add an entity to the forest.
+        local and world are (x, y, r) tuples, rotations in radians.
+        The parent has to be part of the forest already.
+        """
+        if entity_id in self._slots:
+            raise ValueError("Entity %i is already tracked." % entity_id)
+        parent_slot = -1 if parent_id == -1 else self._slots[parent_id]
+        if not self._free_slots:
+            self._grow(self.capacity * 2)
+        slot = self._free_slots.pop()
+        self._slots[entity_id] = slot
+        self.entity_id[slot] = entity_id
+        self.parent[slot] = parent_slot
+        self.used[slot] = True
+        self.local_x[slot], self.local_y[slot], self.local_r[slot] = local
+        self.world_x[slot], self.world_y[slot], self.world_r[slot] = world
+        self.version[slot] += 1
+        self.count += 1
+        self._needs_reindex = True
+        self.mark_dirty(slot)
+        return slot
+
+    def add_many(self, entity_ids, parent_ids, local, world):
+        """
+        Add a batch of entities with a single reindex.
+        local and world are (n, 3) arrays of x, y, r. Parents may be part
+        of the batch itself, in any order.
+        """
+        entity_ids = list(entity_ids)
+        if len(set(entity_ids)) != len(entity_ids) or any(
+                entity_id in self._slots for entity_id in entity_ids):
+            raise ValueError("Entities are already tracked.")
+        while len(self._free_slots) < len(entity_ids):
+            self._grow(self.capacity * 2)
+        slots = [self._free_slots.pop() for _ in entity_ids]
+        self._slots.update(zip(entity_ids, slots))
+        slots = np.array(slots, dtype=np.intp)
+        self.entity_id[slots] = entity_ids
+        self.parent[slots] = [-1 if parent_id == -1 else self._slots[parent_id]
+                              for parent_id in parent_ids]
+        self.used[slots] = True
+        local = np.asarray(local, dtype=np.float64).reshape(-1, 3)
+        world = np.asarray(world, dtype=np.float64).reshape(-1, 3)
+        self.local_x[slots], self.local_y[slots], self.local_r[slots] = local.T
+        self.world_x[slots], self.world_y[slots], self.world_r[slots] = world.T
+        self.version[slots] += 1
+        self.dirty[slots] = True
+        self._any_dirty = True
+        self.count += len(slots)
+        self._needs_reindex = True
+        return slots
+
+    def remove(self, entity_id):
+        """
+        Remove an entity. Its children become roots, just like
+        GameWorld.remove_entity does for attached entities.
+        """
+        slot = self._slots.pop(entity_id)
+        self.parent[self.parent == slot] = -1
+        self.parent[slot] = -1
+        self.entity_id[slot] = -1
+        self.used[slot] = False
+        self.dirty[slot] = False
+        self._free_slots.append(slot)
+        self.count -= 1
+        self._needs_reindex = True
+
+    def remove_many(self, entity_ids):
+        """
+        Remove a batch of entities, children of removed entities
+        become roots.
+        """
+        slots = np.array([self._slots.pop(entity_id)
+                          for entity_id in set(entity_ids)], dtype=np.intp)
+        if not len(slots):
+            return
+        removed = np.zeros(self.capacity + 1, dtype=bool)
+        removed[slots] = True
+        # parent -1 looks up the extra last element, which is never set
+        self.parent[removed[self.parent]] = -1
+        self.parent[slots] = -1
+        self.entity_id[slots] = -1
+        self.used[slots] = False
+        self.dirty[slots] = False
+        self._free_slots.extend(slots.tolist())
+        self.count -= len(slots)
+        self._needs_reindex = True
+
+    def subtree(self, entity_id):
+        """
+        Return the entity ids of entity_id and all its descendants.
+        """
+        self.reindex()
+        inside = np.zeros(self.capacity, dtype=bool)
+        inside[self._slots[entity_id]] = True
+        parent = self.parent
+        for lo, hi in self._levels[1:]:
+            level = self._order[lo:hi]
+            parents = parent[level]
+            inside[level] |= inside[parents]
+        return self.entity_id[inside].tolist()
+
+    def remove_tree(self, entity_id):
+        """
+        Remove an entity and all its descendants, with a single
+        remove_many.
+        """
+        self.remove_many(self.subtree(entity_id))
+
+    def set_parent(self, entity_id, parent_id=-1):
+        """
+        Move entity_id below parent_id (-1 to make it a root).
+        The caller has to make sure this doesn't create a cycle.
+        """
+        slot = self._slots[entity_id]
+        self.parent[slot] = -1 if parent_id == -1 else self._slots[parent_id]
+        self._needs_reindex = True
+        self.mark_dirty(slot)
+
+    def set_parents(self, mapping):
+        """
+        Reparent a batch of entities ({entity_id: parent_id}).
+        Like set_parent the caller has to make sure there are no cycles,
+        the forest is reindexed once on the next propagate().
+        """
+        slots = self._slots
+        children = np.array([slots[entity_id] for entity_id in mapping],
+                            dtype=np.intp)
+        self.parent[children] = [
+            -1 if parent_id == -1 else slots[parent_id]
+            for parent_id in mapping.values()]
+        self.dirty[children] = True
+        self._any_dirty = True
+        self._needs_reindex = True
+
+    def mark_dirty(self, slot):
+        """
+        Flag a slot (and therefore its subtree) for the next propagate().
+        """
+        self.dirty[slot] = True
+        self._any_dirty = True
+
+    def set_local(self, entity_id, x=None, y=None, r=None):
+        slot = self._slots[entity_id]
+        if x is not None:
+            self.local_x[slot] = x
+        if y is not None:
+            self.local_y[slot] = y
+        if r is not None:
+            self.local_r[slot] = r
+        self.mark_dirty(slot)
+
+    def slots_of(self, entity_ids):
+        slots = self._slots
+        return np.fromiter((slots[entity_id] for entity_id in entity_ids),
+                           dtype=np.intp, count=len(entity_ids))
+
+    def offset_local_many(self, entity_ids, dx=0., dy=0., dr=0.):
+        """
+        Add dx, dy, dr (scalars or one value per entity) to the local
+        transforms of a batch of entities. Returns their slots.
+        """
+        slots = self.slots_of(entity_ids)
+        self.local_x[slots] += dx
+        self.local_y[slots] += dy
+        self.local_r[slots] += dr
+        self.dirty[slots] = True
+        self._any_dirty = True
+        return slots
+
+    def query_box(self, x0, y0, x1, y1):
+        """
+        Entity ids whose world position lies inside the box, as of the
+        last propagate().
+        """
+        wx = self.world_x
+        wy = self.world_y
+        inside = self.used & (wx >= x0) & (wx <= x1) & (wy >= y0) & \
+            (wy <= y1)
+        return self.entity_id[inside].tolist()
+
+    def set_world(self, entity_id, x=None, y=None, r=None):
+        """
+        Set the world transform of an entity.
+        This is only meaningful for roots, everything else gets
+        overwritten by the next propagate().
+        """
+        slot = self._slots[entity_id]
+        if x is not None:
+            self.world_x[slot] = x
+        if y is not None:
+            self.world_y[slot] = y
+        if r is not None:
+            self.world_r[slot] = r
+        self.mark_dirty(slot)
+
+    def get_world(self, entity_id):
+        slot = self._slots[entity_id]
+        return (float(self.world_x[slot]), float(self.world_y[slot]),
+                float(self.world_r[slot]))
+
+    def get_local(self, entity_id):
+        slot = self._slots[entity_id]
+        return (float(self.local_x[slot]), float(self.local_y[slot]),
+                float(self.local_r[slot]))
+
+    def reindex(self):
+        """
+        Rebuild the topological order after structural changes.
+        Called automatically by propagate() when needed.
+        """
+        if not self._needs_reindex:
+            return
+        depth = forest_depths(self.parent, self.used)
+        order = np.argsort(depth, kind='stable')
+        order = order[depth[order] >= 0]
+        bounds = np.searchsorted(depth[order], np.arange(depth.max() + 2))
+        self._order = order
+        self._levels = list(zip(bounds[:-1].tolist(), bounds[1:].tolist()))
+        self.depth = depth
+        self._needs_reindex = False
+
+    @property
+    def order(self):
+        """
+        Used slots in topological (depth) order.
+        """
+        self.reindex()
+        return self._order
+
+    def propagate(self):
+        """
+        Compute the world transforms of all dirty subtrees.
+        Returns the recomputed slots in topological order, including the
+        dirty roots, so callers only have to write back those.
+        """
+        if not self._any_dirty:
+            self.recomputed = 0
+            return self._order[:0]
+        self.reindex()
+        order = self._order
+        parent = self.parent
+        dirty = self.dirty
+        lx, ly, lr = self.local_x, self.local_y, self.local_r
+        wx, wy, wr = self.world_x, self.world_y, self.world_r
+        levels = self._levels
+        changed = []
+        if levels:
+            lo, hi = levels[0]
+            roots = order[lo:hi]
+            changed.append(roots[dirty[roots]])
+        for lo, hi in levels[1:]:
+            level = order[lo:hi]
+            level_dirty = dirty[level] | dirty[parent[level]]
+            dirty[level] = level_dirty
+            level = level[level_dirty]
+            if not len(level):
+                continue
+            changed.append(level)
+            p = parent[level]
+            pr = wr[p]
+            cos_r = np.cos(pr)
+            sin_r = np.sin(pr)
+            x = lx[level]
+            y = ly[level]
+            wx[level] = wx[p] + x * cos_r - y * sin_r
+            wy[level] = wy[p] + x * sin_r + y * cos_r
+            wr[level] = pr + lr[level]
+        dirty[:] = False
+        self._any_dirty = False
+        changed = np.concatenate(changed) if changed else order[:0]
+        self.version[changed] += 1
+        self.recomputed = len(changed)
+        self.total_recomputed += self.recomputed
+        return changed
+
+    def _world_matrix(self, slot):
+        # Views into the caches, callers must not keep or modify them
+        version = self.version[slot]
+        if self._matrix_version[slot] != version:
+            x = self.world_x[slot]
+            y = self.world_y[slot]
+            r = self.world_r[slot]
+            c = np.cos(r)
+            s = np.sin(r)
+            self._matrix[slot] = ((c, -s, x), (s, c, y))
+            self._matrix_version[slot] = version
+        return self._matrix[slot]
+
+    def _inverse_world_matrix(self, slot):
+        version = self.version[slot]
+        if self._inverse_version[slot] != version:
+            (c, _, x), (s, _, y) = self._world_matrix(slot)
+            # Rotations are orthogonal, so the inverse is the transposed
+            # rotation applied to the negated translation.
+            self._inverse[slot] = ((c, s, -c * x - s * y),
+                                   (-s, c, s * x - c * y))
+            self._inverse_version[slot] = version
+        return self._inverse[slot]
+
+    def world_matrix(self, entity_id):
+        """
+        2x3 affine matrix mapping the local frame of entity_id to world
+        space, as of the last propagate(). Cached until the entity changes,
+        the result is a copy of the cached matrix.
+        """
+        return self._world_matrix(self._slots[entity_id]).copy()
+
+    def inverse_world_matrix(self, entity_id):
+        """
+        2x3 affine matrix mapping world space to the local frame
+        of entity_id. Cached (and copied) like world_matrix.
+        """
+        return self._inverse_world_matrix(self._slots[entity_id]).copy()
+
+    def local_to_world(self, entity_id, points):
+        """
+        Transform points (an (n, 2) array or a single (x, y) pair) from the
+        local frame of entity_id to world space.
+        """
+        return apply_affine(self._world_matrix(self._slots[entity_id]),
+                            points)
+
+    def world_to_local(self, entity_id, points):
+        """
+        Inverse of local_to_world.
+        """
+        return apply_affine(
+            self._inverse_world_matrix(self._slots[entity_id]), points)
+
+
+def apply_affine(matrix, points):
+    """
+    Apply a 2x3 affine matrix to an (n, 2) array or a single (x, y) pair.
+    """
+    points = np.asarray(points, dtype=np.float64)
+    flat = points.reshape(-1, 2)
+    return (flat.dot(matrix[:, :2].T) + matrix[:, 2]).reshape(points.shape)
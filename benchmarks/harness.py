@@ -0,0 +1,151 @@
+"""
+Runs a demo headless: the App, its kv file and the GameWorld are built
+exactly like App.run() would, but frames are driven by hand through
+Clock.tick() instead of the event loop, as fast as possible.
+
+Kivy only supports one window (and both demos have a module called
+main), so every demo is loaded in its own process, see run.py.
+"""
+import os
+import sys
+import gc
+from timeit import default_timer
+import numpy as np
+
+# Has to be configured before kivy gets imported
+os.environ.setdefault('KIVY_NO_ARGS', '1')
+os.environ.setdefault('KIVY_NO_FILELOG', '1')
+os.environ.setdefault('KIVY_NO_CONSOLELOG', '1')
+if not os.environ.get('DISPLAY') and sys.platform.startswith('linux'):
+    # No X server, render into an offscreen GL context
+    os.environ.setdefault('SDL_VIDEODRIVER', 'offscreen')
+
+from kivy.config import Config
+Config.set('graphics', 'window_state', 'hidden')
+Config.set('graphics', 'width', '1280')
+Config.set('graphics', 'height', '720')
+# Don't sleep between frames
+Config.set('graphics', 'maxfps', '0')
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEMOS = ('pick_object', 'attachment_system')
+sys.path.append(ROOT)
+from demo_utils.replay import ReplayTouch
+
+
+def peak_rss_mb():
+    """
+    Peak resident memory of this process in MB, None if unknown.
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        return peak / (1024. * 1024.)
+    return peak / 1024.
+
+
+class DemoHarness(object):
+    """
+    Loads the demo in ROOT/<demo> and waits for its init_game callback.
+    The demo directory becomes the working directory, as the demos load
+    their assets with relative paths.
+    """
+    def __init__(self, demo, max_init_frames=300):
+        if demo not in DEMOS:
+            raise ValueError("Unknown demo %r." % (demo, ))
+        self.demo = demo
+        directory = os.path.join(ROOT, demo)
+        os.chdir(directory)
+        sys.path.insert(0, directory)
+        self.startup_seconds = 0.
+        start = default_timer()
+        import main
+        from kivy.clock import Clock
+        from kivy.core.window import Window
+        self.module = main
+        self.clock = Clock
+        self.app = main.YourAppNameApp()
+        self.app.load_kv()
+        self.game = self.app.root
+        Window.add_widget(self.game)
+        for _ in range(max_init_frames):
+            Clock.tick()
+            if self.game.gameworld.state == 'main':
+                break
+        else:
+            raise RuntimeError("%s did not finish init_game." % demo)
+        self.startup_seconds = default_timer() - start
+
+    def frame(self):
+        self.clock.tick()
+
+    def run_frames(self, count):
+        """
+        Run count frames, returns their durations in seconds.
+        """
+        durations = np.empty(count, dtype=np.float64)
+        tick = self.clock.tick
+        for i in range(count):
+            start = default_timer()
+            tick()
+            durations[i] = default_timer() - start
+        return durations
+
+    def export_reports(self):
+        """
+        Write the per system timings (PROFILE_EXPORT) and the zone usage
+        (ZONE_REPORT) of the run if asked for. App.on_stop does that for
+        the demos, but the harness never stops the app. The paths have
+        to be absolute, as the working directory is the demo directory.
+        """
+        path = os.environ.get('PROFILE_EXPORT')
+        if path:
+            self.game.profiler.export(path)
+        path = os.environ.get('ZONE_REPORT')
+        if path:
+            self.game.telemetry.export(path)
+
+    def click(self, pos):
+        game = self.game
+        game.on_mouse_click(game.gameworld, ReplayTouch(pos))
+
+
+class timed(object):
+    """
+    with timed() as timer: ...; timer.seconds is the elapsed wall time.
+    The garbage collector is disabled inside, so its pauses don't end up
+    in whichever scenario happens to trigger a collection.
+    """
+    def __enter__(self):
+        gc.collect()
+        self._gc_enabled = gc.isenabled()
+        gc.disable()
+        self.seconds = 0.
+        self._start = default_timer()
+        return self
+
+    def __exit__(self, *args):
+        self.seconds = default_timer() - self._start
+        if self._gc_enabled:
+            gc.enable()
+
+
+def frame_metrics(durations, prefix='frame'):
+    """
+    p50/p95/max of frame durations (in seconds) as ms metrics.
+    """
+    if not len(durations):
+        return {}
+    ms = np.asarray(durations) * 1000.
+    p50, p95 = np.percentile(ms, (50, 95))
+    return {
+        prefix + '_p50_ms': float(p50),
+        prefix + '_p95_ms': float(p95),
+        prefix + '_max_ms': float(ms.max()),
+    }
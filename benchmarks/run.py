@@ -0,0 +1,214 @@
+"""
+Headless benchmark runner.
+
+    python benchmarks/run.py                  run everything, compare
+    python benchmarks/run.py -k hierarchy     only matching cases
+    python benchmarks/run.py --save-baseline  store the results as baseline
+    python benchmarks/run.py --replay log.json  replay a recorded session
+
+Every case runs in a fresh process (see harness.py). The results are
+compared against baseline.json; if a metric got worse by more than the
+tolerance the run exits with status 1.
+"""
+from __future__ import print_function
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_BASELINE = os.path.join(HERE, 'baseline.json')
+RESULT_PREFIX = 'BENCHMARK_RESULT '
+
+# (scenario, parameters), see scenarios.py
+CASES = [
+    ('spawn', {'n': 1000}),
+    ('spawn', {'n': 5000}),
+    ('spawn', {'n': 15000}),
+    ('pick', {'n': 1000}),
+    ('pick', {'n': 5000}),
+    ('hierarchy', {'depth': 3, 'fanout': 10}),
+    ('hierarchy', {'depth': 4, 'fanout': 6}),
+    ('hierarchy', {'depth': 10, 'fanout': 2}),
+    ('hierarchy', {'depth': 1000, 'fanout': 1}),
+    ('hierarchy', {'depth': 2, 'fanout': 1, 'roots': 900}),
+    ('bulk_edit', {'n': 5000}),
+    ('bulk_transform', {'roots': 15, 'fanout': 100}),
+]
+
+
+def case_name(scenario, params):
+    return '%s[%s]' % (scenario, ','.join(
+        '%s=%s' % item for item in sorted(params.items())))
+
+
+def run_child(scenario, params):
+    """
+    Runs one case in this process and prints its metrics.
+    """
+    from scenarios import SCENARIOS
+    from harness import DemoHarness, peak_rss_mb
+    demo, function = SCENARIOS[scenario]
+    if demo is None:
+        demo = params.pop('demo')
+    harness = DemoHarness(demo)
+    metrics = function(harness, **params)
+    metrics['startup_ms'] = harness.startup_seconds * 1000.
+    metrics['peak_rss_mb'] = peak_rss_mb()
+    print(RESULT_PREFIX + json.dumps(metrics))
+    sys.stdout.flush()
+
+
+def run_case(scenario, params):
+    process = subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), '--child', scenario,
+         json.dumps(params)],
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+        universal_newlines=True)
+    out, err = process.communicate()
+    for line in out.splitlines():
+        if line.startswith(RESULT_PREFIX):
+            return json.loads(line[len(RESULT_PREFIX):])
+    raise RuntimeError("%s failed (exit code %s):\n%s" % (
+        case_name(scenario, params), process.returncode, err[-4000:]))
+
+
+def median_metrics(runs):
+    merged = {}
+    for metric in runs[0]:
+        values = sorted(run[metric] for run in runs
+                        if run.get(metric) is not None)
+        merged[metric] = values[len(values) // 2] if values else None
+    return merged
+
+
+def slowdown(metric, old, new):
+    """
+    How many times worse new is compared to old, None for
+    informational metrics.
+    """
+    if not old or new is None or metric.endswith('_max_ms'):
+        # Single worst frames are too noisy to compare
+        return None
+    if metric.endswith('_per_s'):
+        return old / new if new else float('inf')
+    if metric.endswith('_ms') or metric.endswith('_mb'):
+        return new / old
+    return None
+
+
+def compare(results, baseline, tolerance, memory_tolerance, min_ms):
+    """
+    Returns the rows (case, metric, old, new, ratio, failed) of all
+    metrics present in both results and baseline.
+    """
+    rows = []
+    for name in sorted(results):
+        old_metrics = baseline.get(name)
+        if old_metrics is None:
+            continue
+        for metric, new in sorted(results[name].items()):
+            old = old_metrics.get(metric)
+            ratio = slowdown(metric, old, new)
+            if ratio is None:
+                continue
+            limit = memory_tolerance if metric.endswith('_mb') else tolerance
+            failed = ratio > 1. + limit
+            if failed and metric.endswith('_ms') and new - old < min_ms:
+                # Tiny absolute differences are timer noise
+                failed = False
+            rows.append((name, metric, old, new, ratio, failed))
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('-k', dest='filter', default='',
+                        help='only run cases containing this text')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='runs per case, the median is kept')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE)
+    parser.add_argument('--save-baseline', action='store_true',
+                        help='merge the results into the baseline file')
+    parser.add_argument('--tolerance', type=float, default=.25,
+                        help='allowed slowdown, .25 means 25%%')
+    parser.add_argument('--memory-tolerance', type=float, default=.10)
+    parser.add_argument('--min-ms', type=float, default=.25,
+                        help='ignore time regressions smaller than this')
+    parser.add_argument('--output', help='also write the results to a file')
+    parser.add_argument('--replay', action='append', default=[],
+                        metavar='LOG', help='replay a recorded input log '
+                        '(RECORD_INPUT) instead of the default cases')
+    parser.add_argument('--fixed-step', type=float,
+                        help='replay with this frame time instead of the '
+                        'recorded ones')
+    parser.add_argument('--child', nargs=2, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        scenario, params = args.child
+        run_child(scenario, json.loads(params))
+        return 0
+
+    # The children run in the demo directories
+    for name in ('PROFILE_EXPORT', 'ZONE_REPORT'):
+        if os.environ.get(name):
+            os.environ[name] = os.path.abspath(os.environ[name])
+    cases = CASES
+    if args.replay:
+        cases = []
+        for path in args.replay:
+            with open(path) as source:
+                demo = json.load(source)['meta']['demo']
+            params = {'demo': demo, 'log': os.path.abspath(path)}
+            if args.fixed_step:
+                params['fixed_step'] = args.fixed_step
+            cases.append(('replay', params))
+    results = {}
+    for scenario, params in cases:
+        name = case_name(scenario, params)
+        if args.filter not in name:
+            continue
+        print('%-45s' % name, end='')
+        sys.stdout.flush()
+        runs = [run_case(scenario, params) for _ in range(args.repeat)]
+        results[name] = median_metrics(runs)
+        print(' '.join('%s=%.4g' % (metric, value)
+                       for metric, value in sorted(results[name].items())
+                       if value is not None and metric.endswith('_per_s')))
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(results, output, indent=2, sort_keys=True)
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as source:
+            baseline = json.load(source)
+    if args.save_baseline:
+        baseline.update(results)
+        with open(args.baseline, 'w') as output:
+            json.dump(baseline, output, indent=2, sort_keys=True)
+        print('Baseline written to %s' % args.baseline)
+        return 0
+    if not baseline:
+        print('No baseline at %s, run with --save-baseline first.'
+              % args.baseline)
+        return 0
+
+    rows = compare(results, baseline, args.tolerance, args.memory_tolerance,
+                   args.min_ms)
+    failures = [row for row in rows if row[5]]
+    print()
+    for name, metric, old, new, ratio, failed in rows:
+        print('%-45s %-20s %12.4g %12.4g %6.2fx%s' % (
+            name, metric, old, new, ratio, '  REGRESSION' if failed else ''))
+    if failures:
+        print('\n%i metric(s) regressed by more than the tolerance.'
+              % len(failures))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,228 @@
+"""
+Benchmark scenarios. Every scenario gets a loaded DemoHarness plus its
+parameters and returns a flat dict of metrics. Metric names end with
+their unit: _per_s (higher is better), _ms and _mb (lower is better);
+everything else is informational and never compared to the baseline.
+"""
+import random
+from timeit import default_timer
+import numpy as np
+from harness import timed, frame_metrics
+from demo_utils.replay import load_log
+
+
+def spawn(harness, n=5000, spread=4000, frames=120, seed=0):
+    """
+    n asteroids created one by one through create_asteroid, spread over
+    a spread x spread world, then frames simulated frames.
+    """
+    game = harness.game
+    random.seed(seed)
+    rng = np.random.RandomState(seed)
+    positions = rng.uniform(0, spread, (n, 2)).tolist()
+    create_asteroid = game.create_asteroid
+    with timed() as timer:
+        for pos in positions:
+            create_asteroid(pos)
+    metrics = {
+        'spawn_per_s': n / timer.seconds,
+        'spawn_ms': timer.seconds * 1000.,
+    }
+    metrics.update(frame_metrics(harness.run_frames(frames)))
+    metrics['active'] = game.culler.active_count
+    return metrics
+
+
+def pick(harness, n=5000, clicks=2000, clicks_per_frame=10, seed=0):
+    """
+    clicks random clicks through on_mouse_click with n asteroids on
+    screen. Frames keep running in between, so the pick index has to
+    catch up with the moving asteroids like in the real demo.
+    """
+    game = harness.game
+    rng = np.random.RandomState(seed)
+    game._rng.seed(seed)
+    game.spawn_asteroids(n, region=game.get_camera_region())
+    harness.run_frames(10)
+    width, height = game.size
+    positions = np.column_stack((rng.uniform(0, width, clicks),
+                                 rng.uniform(0, height, clicks))).tolist()
+    # Clicks on the button pane are ignored by the demo
+    pane_top = game._btn_pane.top
+    positions = [(x, max(y, pane_top + 1)) for x, y in positions]
+    click = harness.click
+    app = harness.app
+    hits = 0
+    elapsed = 0.
+    for start in range(0, clicks, clicks_per_frame):
+        harness.frame()
+        begin = default_timer()
+        for pos in positions[start:start + clicks_per_frame]:
+            click(pos)
+            hits += app.selected_id is not None
+        elapsed += default_timer() - begin
+    return {
+        'clicks_per_s': clicks / elapsed,
+        'click_mean_ms': elapsed * 1000. / clicks,
+        'hit_ratio': float(hits) / clicks,
+    }
+
+
+def hierarchy(harness, depth=4, fanout=6, roots=1, frames=120,
+              reparents=200, seed=0):
+    """
+    Builds roots trees of the given depth, every node having fanout
+    children, through create_entity and one track_entities per level,
+    like the demo does for every batch it spawns. Then rotates the
+    children of the roots every frame, so every global transform below
+    the roots changes (the attachment system ignores the locals of
+    roots, rotating those would just recompute identical values). Finally
+    moves random subtrees with reparent_many, one at a time with a cycle
+    check before each like the parent dropdown does. Single edges take
+    AncestryIndex.move (O(n)), not the O(n log n) batch rebuild.
+    """
+    game = harness.game
+    api = game.demoApi
+    rng = np.random.RandomState(seed)
+    create_entity = game.create_entity
+    entity_ids = []
+    level = [-1]
+    with timed() as build:
+        for d in range(depth):
+            children = []
+            for parent_id in level:
+                for _ in range(roots if parent_id == -1 else fanout):
+                    children.append(create_entity(parent_id, (25, 0),
+                                                  track=False))
+            api.track_entities(children)
+            entity_ids.extend(children)
+            level = children
+    n = len(entity_ids)
+    # The first level below the roots
+    rotated_ids = entity_ids[roots:roots + roots * fanout]
+    metrics = {
+        'entities': n,
+        'build_per_s': n / build.seconds,
+    }
+    game.profiler.reset()
+    durations = np.empty(frames, dtype=np.float64)
+    set_local_rotation = api.set_local_rotation
+    for frame in range(frames):
+        start = default_timer()
+        for entity_id in rotated_ids:
+            set_local_rotation(entity_id, frame % 360)
+        harness.frame()
+        durations[frame] = default_timer() - start
+    metrics.update(frame_metrics(durations))
+    transforms = game.profiler.summary().get('transforms')
+    if transforms is not None:
+        metrics['transforms_p50_ms'] = transforms['p50']
+        metrics['transforms_p95_ms'] = transforms['p95']
+    if n > 1 and reparents:
+        # Candidates that would create a cycle are skipped, like the
+        # demo UI would refuse them.
+        candidates = rng.choice(entity_ids, (reparents * 4, 2)).tolist()
+        is_ancestor = api.is_ancestor
+        reparent_many = api.reparent_many
+        moved = 0
+        with timed() as timer:
+            for entity_id, parent_id in candidates:
+                if is_ancestor(entity_id, parent_id):
+                    continue
+                reparent_many({entity_id: parent_id})
+                moved += 1
+                if moved == reparents:
+                    break
+        metrics['reparent_per_s'] = moved / timer.seconds
+    return metrics
+
+
+def bulk_edit(harness, n=5000, seed=0):
+    """
+    Selects n asteroids and runs every bulk edit of the selection once,
+    each followed by a frame. edit_ms is the edit plus its frame, which
+    should stay within one frame budget.
+    """
+    game = harness.game
+    game._rng.seed(seed)
+    game.spawn_asteroids(n, region=game.get_camera_region())
+    harness.run_frames(10)
+    edits = [
+        ('select', lambda: game.select_entities(game.pick_index.entity_ids)),
+        ('velocity', lambda: game.set_selection_velocity(10, -10)),
+        ('scale', lambda: game.scale_selection_velocity(.5)),
+        ('forces', game.zero_selection_forces),
+        ('recolor', lambda: game.recolor_selection((0, 128, 255, 255))),
+        ('destroy', game.destroy_selection),
+    ]
+    metrics = {}
+    for name, edit in edits:
+        with timed() as timer:
+            edit()
+            harness.frame()
+        metrics['%s_ms' % name] = timer.seconds * 1000.
+    return metrics
+
+
+def bulk_transform(harness, roots=15, fanout=100, frames=60, seed=0):
+    """
+    roots trees with fanout children each; every frame all children
+    get translated and rotated through one translate_many / rotate_many.
+    The attachment demo's zone holds 2000 entities, so keep
+    roots * (fanout + 1) below that.
+    """
+    game = harness.game
+    api = game.demoApi
+    rng = np.random.RandomState(seed)
+    create_entity = game.create_entity
+    root_ids = []
+    child_ids = []
+    for _ in range(roots):
+        root_id = create_entity(-1, (0, 0), track=False,
+                                position=tuple(rng.uniform(0, 1000, 2)))
+        root_ids.append(root_id)
+        child_ids.extend(create_entity(root_id, (25, 0), track=False)
+                         for _ in range(fanout))
+    api.track_entities(root_ids + child_ids)
+    harness.frame()
+    offsets = rng.uniform(-1, 1, (frames, len(child_ids), 2))
+    durations = np.empty(frames, dtype=np.float64)
+    for frame in range(frames):
+        start = default_timer()
+        api.translate_many(child_ids, offsets[frame, :, 0],
+                           offsets[frame, :, 1])
+        api.rotate_many(child_ids, 1.)
+        harness.frame()
+        durations[frame] = default_timer() - start
+    metrics = frame_metrics(durations)
+    metrics['entities'] = roots * (fanout + 1)
+    return metrics
+
+
+def replay(harness, log, fixed_step=None):
+    """
+    Replays an input log recorded with RECORD_INPUT=<log> as fast as
+    possible, see demo_utils.replay.
+    """
+    from kivy.core.window import Window
+    log = load_log(log)
+    Window.size = log['meta']['window_size']
+    harness.frame()
+    durations = harness.game.prepare_replay(log, fixed_step).run()
+    harness.export_reports()
+    metrics = frame_metrics(durations)
+    metrics['frames'] = len(durations)
+    metrics['frames_per_s'] = len(durations) / max(durations.sum(), 1e-9)
+    return metrics
+
+
+# scenario: (demo, function), a demo of None is taken from the demo
+# parameter of the case.
+SCENARIOS = {
+    'spawn': ('pick_object', spawn),
+    'pick': ('pick_object', pick),
+    'hierarchy': ('attachment_system', hierarchy),
+    'bulk_edit': ('pick_object', bulk_edit),
+    'bulk_transform': ('attachment_system', bulk_transform),
+    'replay': (None, replay),
+}
@@ -0,0 +1,4 @@
+"""
+Helpers shared by the demos.
+The demos add the repository root to sys.path to import this package.
+"""
@@ -0,0 +1,234 @@
+"""
+Texture atlas packing and lazy texture loading.
+
+Build step: pack all images of a demo (loose pngs and the regions of
+existing atlases) into power of two atlas pages, so every entity renders
+from the same texture:
+
+    python -m demo_utils.assets pick_object attachment_system
+
+writes <demo>/assets/atlas/<demo>.atlas (a regular kivy atlas) plus its
+pages. The sources are recorded next to it and the atlas is only rebuilt
+if one of them changed. Packing needs PIL, running the demos doesn't.
+
+At runtime AssetCatalog only reads the atlas json files and directory
+listings to learn which texture names exist. An image or atlas page is
+decoded by the texture manager the first time one of its names is
+required.
+"""
+from __future__ import print_function
+import json
+import os
+import shutil
+import tempfile
+from glob import glob
+
+BUILD_DIRECTORY = 'atlas'
+MAX_ATLAS_SIZE = 4096
+
+
+def _atlas_pages(path):
+    with open(path) as source:
+        return json.load(source)
+
+
+class AssetCatalog(object):
+    """
+    Maps texture names to the file that has to be loaded for them.
+    The first registration of a name wins.
+    """
+    def __init__(self, texture_manager):
+        self.texture_manager = texture_manager
+        self._sources = {}
+        self._loaded = set()
+        self._loaded_sources = set()
+
+    def __contains__(self, name):
+        return name in self._sources
+
+    @property
+    def names(self):
+        return list(self._sources)
+
+    def add_atlas(self, path):
+        for regions in _atlas_pages(path).values():
+            for name in regions:
+                self._sources.setdefault(name, ('atlas', path))
+
+    def add_image(self, path, name=None):
+        if name is None:
+            name = os.path.splitext(os.path.basename(path))[0]
+        self._sources.setdefault(name, ('image', path))
+
+    def discover(self, *directories):
+        """
+        Register the atlases and loose pngs of the given directories,
+        earlier directories take precedence. Pages of atlases are not
+        registered as images of their own. Missing directories are
+        skipped.
+        """
+        for directory in directories:
+            if not os.path.isdir(directory):
+                continue
+            pages = set()
+            for path in sorted(glob(os.path.join(directory, '*.atlas'))):
+                pages.update(_atlas_pages(path))
+                self.add_atlas(path)
+            for path in sorted(glob(os.path.join(directory, '*.png'))):
+                if os.path.basename(path) not in pages:
+                    self.add_image(path)
+
+    def require(self, name):
+        """
+        Make sure the texture name is loaded.
+        """
+        if name in self._loaded:
+            return
+        kind, path = self._sources[name]
+        if path not in self._loaded_sources:
+            if kind == 'atlas':
+                self.texture_manager.load_atlas(path)
+            else:
+                self.texture_manager.load_image(path)
+            self._loaded_sources.add(path)
+        self._loaded.add(name)
+
+    def stats(self):
+        return {
+            'registered': len(self._sources),
+            'loaded': len(self._loaded),
+            'loaded_files': len(self._loaded_sources),
+        }
+
+
+def _next_power_of_two(value):
+    size = 1
+    while size < value:
+        size *= 2
+    return size
+
+
+def _source_state(paths):
+    return dict((path, [os.path.getsize(path), os.path.getmtime(path)])
+                for path in paths)
+
+
+def _extract_regions(atlas_path, directory):
+    """
+    Write every region of a kivy atlas as a png of its own.
+    """
+    from PIL import Image
+    atlas_directory = os.path.dirname(atlas_path)
+    paths = []
+    for page, regions in _atlas_pages(atlas_path).items():
+        image = Image.open(os.path.join(atlas_directory, page))
+        image.load()
+        height = image.size[1]
+        for name, (x, y, w, h) in regions.items():
+            # Atlas coordinates start at the bottom
+            top = height - y - h
+            path = os.path.join(directory, name + '.png')
+            image.crop((x, top, x + w, top + h)).save(path)
+            paths.append(path)
+    return paths
+
+
+def build_atlas(sources, outname, padding=2, max_size=MAX_ATLAS_SIZE,
+                force=False):
+    """
+    Pack the given pngs and atlases into outname.atlas with pages
+    outname-<n>.png. The page size is the smallest power of two that
+    fits everything on one page, up to max_size (more pages are created
+    beyond that). Returns False if the atlas was up to date.
+    """
+    from kivy.atlas import Atlas
+    sources = sorted(sources)
+    state = {'sources': _source_state(sources), 'padding': padding,
+             'max_size': max_size}
+    state_path = outname + '.atlas.build'
+    if not force and os.path.exists(outname + '.atlas') \
+            and os.path.exists(state_path):
+        with open(state_path) as source:
+            if json.load(source) == state:
+                return False
+    from PIL import Image
+    work = tempfile.mkdtemp()
+    try:
+        images = []
+        for path in sources:
+            if path.endswith('.atlas'):
+                images.extend(_extract_regions(path, work))
+            else:
+                images.append(path)
+        sizes = []
+        for path in images:
+            with open(path, 'rb') as source:
+                sizes.append(Image.open(source).size)
+        area = sum((w + padding) * (h + padding) for w, h in sizes)
+        size = _next_power_of_two(max(
+            [int(area ** .5)] + [max(w, h) + padding for w, h in sizes]))
+        name = os.path.basename(outname)
+        while True:
+            size = min(size, max_size)
+            for old in glob(os.path.join(work, name + '-*.png')):
+                os.remove(old)
+            result = Atlas.create(os.path.join(work, name), images, size,
+                                  padding=padding)
+            if not result:
+                raise ValueError("Images don't fit into %ix%i pages."
+                                 % (size, size))
+            meta = result[1]
+            if len(meta) == 1 or size >= max_size:
+                break
+            size *= 2
+        directory = os.path.dirname(outname)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        for old in glob(outname + '-*.png'):
+            os.remove(old)
+        for page in list(meta) + [name + '.atlas']:
+            shutil.move(os.path.join(work, page),
+                        os.path.join(directory, page))
+    finally:
+        shutil.rmtree(work)
+    with open(state_path, 'w') as output:
+        json.dump(state, output)
+    return True
+
+
+def demo_sources(assets_directory):
+    """
+    The loose pngs and atlases of a demo's assets directory, without
+    the pages of those atlases.
+    """
+    atlases = sorted(glob(os.path.join(assets_directory, '*.atlas')))
+    pages = set()
+    for path in atlases:
+        pages.update(_atlas_pages(path))
+    return atlases + [
+        path for path in sorted(glob(os.path.join(assets_directory, '*.png')))
+        if os.path.basename(path) not in pages]
+
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(
+        description='Pack the assets of demos into one atlas per demo.')
+    parser.add_argument('demos', nargs='+', help='demo directories')
+    parser.add_argument('--padding', type=int, default=2)
+    parser.add_argument('--max-size', type=int, default=MAX_ATLAS_SIZE)
+    parser.add_argument('--force', action='store_true')
+    args = parser.parse_args(argv)
+    for demo in args.demos:
+        assets = os.path.join(demo, 'assets')
+        name = os.path.basename(os.path.abspath(demo))
+        outname = os.path.join(assets, BUILD_DIRECTORY, name)
+        if build_atlas(demo_sources(assets), outname, args.padding,
+                       args.max_size, args.force):
+            print('Built %s.atlas' % outname)
+        else:
+            print('%s.atlas is up to date' % outname)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+"""
+View frustum culling on top of a UniformGrid.
+
+Entities inside the camera bounds (plus margin) are active: rendered and
+simulated. Everything else gets deactivated through a callback, which
+for the demos means "don't render" and "take the physics body out of
+the space".
+
+Only active entities move, so only their positions are synced into the
+grid every frame; entities entering the view are found with a grid box
+query. The per frame cost therefore depends on what is on screen, not on
+the size of the world.
+
+An entity gets active as soon as it is within margin of the bounds, but
+only gets deactivated once it is more than margin + hysteresis away, so
+entities moving along the edge don't flap between both states.
+"""
+import numpy as np
+
+
+class FrustumCuller(object):
+    """
+    read_positions(entity_ids) returns (xs, ys) of the given entities,
+    activate(entity_ids) and deactivate(entity_ids) switch their state.
+
+    Deactivated entities are expected to stay where they are. As they can
+    still be moved by hand, resync_count of them get their grid position
+    refreshed every update, round robin. The resync only reads positions,
+    deactivate is called exactly once per deactivation.
+    """
+    def __init__(self, index, read_positions, activate, deactivate,
+                 margin=64., hysteresis=64., resync_count=64):
+        self.index = index
+        self.read_positions = read_positions
+        self.activate = activate
+        self.deactivate = deactivate
+        self.margin = margin
+        self.hysteresis = hysteresis
+        self.resync_count = resync_count
+        self.active = set()
+        self._resync_queue = []
+        self.visible_count = 0
+        self.active_count = 0
+
+    def add(self, entity_id):
+        """
+        Register a new entity, new entities are active.
+        The entity has to be part of the index already.
+        """
+        self.active.add(entity_id)
+
+    def remove(self, entity_id):
+        self.active.discard(entity_id)
+
+    def _resync_culled(self, skip):
+        """
+        Refresh the grid positions of the next culled entities. Entities
+        in skip (deactivated by the running update, so their positions
+        are current) are left out.
+        """
+        queue = self._resync_queue
+        if not queue:
+            queue.extend(entity_id for entity_id in self.index.entity_ids
+                         if entity_id not in self.active)
+        batch = queue[-self.resync_count:]
+        del queue[-self.resync_count:]
+        batch = [entity_id for entity_id in batch
+                 if entity_id in self.index and entity_id not in self.active
+                 and entity_id not in skip]
+        if batch:
+            xs, ys = self.read_positions(batch)
+            self.index.update(batch, xs, ys)
+
+    def update(self, bounds):
+        """
+        Update the active set for the camera bounds (left, bottom, right,
+        top). Returns the (activated, deactivated) entity ids.
+        """
+        x0, y0, x1, y1 = bounds
+        index = self.index
+        active = self.active
+        deactivated = []
+        if active:
+            entity_ids = list(active)
+            xs, ys = self.read_positions(entity_ids)
+            xs = np.asarray(xs, dtype=np.float64)
+            ys = np.asarray(ys, dtype=np.float64)
+            index.update(entity_ids, xs, ys)
+            reach = self.margin + self.hysteresis
+            outside = ((xs < x0 - reach) | (xs > x1 + reach) |
+                       (ys < y0 - reach) | (ys > y1 + reach))
+            if outside.any():
+                deactivated = np.asarray(entity_ids)[outside].tolist()
+                active.difference_update(deactivated)
+        if self.resync_count:
+            self._resync_culled(set(deactivated))
+        margin = self.margin
+        activated = [entity_id for entity_id in index.query_box(
+            x0 - margin, y0 - margin, x1 + margin, y1 + margin, order=None)
+            if entity_id not in active]
+        active.update(activated)
+        if deactivated:
+            self.deactivate(deactivated)
+        if activated:
+            self.activate(activated)
+        self.active_count = len(active)
+        self.visible_count = len(index.query_box(x0, y0, x1, y1, order=None))
+        return activated, deactivated
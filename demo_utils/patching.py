@@ -0,0 +1,35 @@
+"""
+Wrapping the methods of single objects.
+
+The profiler, the input recorder, the zone telemetry and the replay
+clock replace methods of one object (a system, the game widget, the
+gameworld, the clock) by wrappers. A wrapper is stored as an instance
+attribute, which shadows the method of the class; deleting the instance
+attribute makes the class method visible again.
+"""
+
+
+class InstancePatches(object):
+    """
+    Wrappers installed by patch(), all removed again by restore().
+    Patching the same attribute twice is not supported.
+    """
+    def __init__(self):
+        self._patched = []
+
+    def __len__(self):
+        return len(self._patched)
+
+    def patch(self, obj, name, make_wrapper):
+        """
+        Replace obj.name by make_wrapper(original) and return the wrapper.
+        """
+        wrapper = make_wrapper(getattr(obj, name))
+        setattr(obj, name, wrapper)
+        self._patched.append((obj, name))
+        return wrapper
+
+    def restore(self):
+        for obj, name in reversed(self._patched):
+            delattr(obj, name)
+        del self._patched[:]
@@ -0,0 +1,153 @@
+"""
+Per system frame time instrumentation.
+
+SystemProfiler wraps the update method of every GameWorld system (and
+any other callable passed to wrap) and records how long each call took.
+The last window samples per name are kept in a ring buffer, summary()
+turns them into p50/p95/p99 statistics and export() writes them as CSV
+or JSON, so a headless run can be compared against another one.
+"""
+import csv
+import json
+from contextlib import contextmanager
+from functools import partial, wraps
+from timeit import default_timer
+import numpy as np
+from .patching import InstancePatches
+
+
+class RollingSamples(object):
+    __slots__ = ('samples', 'count', 'total', 'worst')
+
+    def __init__(self, window):
+        self.samples = np.zeros(window, dtype=np.float64)
+        self.count = 0
+        self.total = 0.
+        self.worst = 0.
+
+    def add(self, value):
+        self.samples[self.count % len(self.samples)] = value
+        self.count += 1
+        self.total += value
+        if value > self.worst:
+            self.worst = value
+
+    def window(self):
+        return self.samples[:min(self.count, len(self.samples))]
+
+
+class SystemProfiler(object):
+    """
+    Times are recorded in seconds and reported in milliseconds.
+    """
+    def __init__(self, gameworld=None, window=600):
+        self.gameworld = gameworld
+        self.window = window
+        self.stats = {}
+        self._installed = set()
+        self._patches = InstancePatches()
+
+    def record(self, name, seconds):
+        stats = self.stats.get(name)
+        if stats is None:
+            stats = self.stats[name] = RollingSamples(self.window)
+        stats.add(seconds)
+
+    def wrap(self, name, function):
+        """
+        Returns function wrapped so every call gets recorded as name.
+        """
+        record = self.record
+
+        @wraps(function)
+        def timed(*args, **kwargs):
+            start = default_timer()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                record(name, default_timer() - start)
+        return timed
+
+    @contextmanager
+    def section(self, name):
+        start = default_timer()
+        try:
+            yield
+        finally:
+            self.record(name, default_timer() - start)
+
+    def install(self, system_ids=None):
+        """
+        Start timing the update of the given systems (all updateable
+        systems of the gameworld by default).
+        """
+        system_manager = self.gameworld.system_manager
+        if system_ids is None:
+            system_ids = [system.system_id
+                          for system in system_manager.systems
+                          if system is not None and system.updateable]
+        for system_id in system_ids:
+            if system_id in self._installed:
+                continue
+            self._patches.patch(system_manager[system_id], 'update',
+                                partial(self.wrap, system_id))
+            self._installed.add(system_id)
+
+    def uninstall(self):
+        self._patches.restore()
+        self._installed.clear()
+
+    def reset(self):
+        self.stats.clear()
+
+    def summary(self):
+        """
+        Returns {name: {count, mean, p50, p95, p99, max}}, times in ms.
+        Percentiles are computed over the rolling window, count, mean and
+        max over the whole run.
+        """
+        result = {}
+        for name, stats in self.stats.items():
+            window = stats.window() * 1000.
+            if not len(window):
+                continue
+            p50, p95, p99 = np.percentile(window, (50, 95, 99))
+            result[name] = {
+                'count': stats.count,
+                'mean': stats.total * 1000. / stats.count,
+                'p50': float(p50),
+                'p95': float(p95),
+                'p99': float(p99),
+                'max': stats.worst * 1000.,
+            }
+        return result
+
+    def format_table(self):
+        """
+        Summary as text, slowest p95 first.
+        """
+        summary = self.summary()
+        lines = ['%-22s %7s %7s %7s' % ('system (ms)', 'p50', 'p95', 'p99')]
+        for name in sorted(summary, key=lambda name: -summary[name]['p95']):
+            row = summary[name]
+            lines.append('%-22s %7.2f %7.2f %7.2f' % (
+                name, row['p50'], row['p95'], row['p99']))
+        return '\n'.join(lines)
+
+    def export(self, path):
+        """
+        Write the summary to path, as JSON if it ends with .json,
+        as CSV otherwise.
+        """
+        summary = self.summary()
+        if path.endswith('.json'):
+            with open(path, 'w') as output:
+                json.dump(summary, output, indent=2, sort_keys=True)
+            return
+        fields = ['count', 'mean', 'p50', 'p95', 'p99', 'max']
+        with open(path, 'w') as output:
+            writer = csv.writer(output)
+            writer.writerow(['name'] + fields)
+            for name in sorted(summary):
+                writer.writerow([name] + [summary[name][field]
+                                          for field in fields])
@@ -0,0 +1,187 @@
+"""
+Deterministic input recording and replay.
+
+InputRecorder wraps the UI handlers of a game widget (instance attribute
+wrappers, see demo_utils.patching) and logs every call with the frame
+it happened in, plus the duration of every frame. Handlers called from
+within another recorded handler are not logged, replaying the outer call
+triggers them again.
+
+Replayer feeds the log back into a freshly started demo. The clock is
+switched to virtual time, which advances by exactly the recorded frame
+times (or a fixed step), so timers and physics see the same timesteps
+as during the recording while frames run as fast as possible.
+
+What gets recorded is given by channels, {name: (encode, replay)}:
+encode(*args, **kwargs) turns a call into JSON data, replay(game, data)
+performs it again. Both default to storing the plain arguments.
+"""
+import json
+import random
+from timeit import default_timer
+import numpy as np
+from .patching import InstancePatches
+
+LOG_VERSION = 1
+
+
+def seed_everything(seed, *rngs):
+    """
+    Seed the random module, NumPy's global state and the given
+    RandomState instances.
+    """
+    random.seed(seed)
+    np.random.seed(seed)
+    for rng in rngs:
+        rng.seed(seed)
+
+
+def encode_arguments(*args, **kwargs):
+    return {'args': list(args), 'kwargs': kwargs}
+
+
+def replay_arguments(name):
+    def replay(game, data):
+        getattr(game, name)(*data['args'], **data['kwargs'])
+    return replay
+
+
+class ReplayTouch(object):
+    """
+    Stand-in for the touch of a recorded click.
+    """
+    __slots__ = ('pos', 'x', 'y')
+
+    def __init__(self, pos):
+        self.pos = tuple(pos)
+        self.x, self.y = self.pos
+
+
+class InputRecorder(object):
+    def __init__(self, game, channels, clock, seed=None, meta=None):
+        self.game = game
+        self.clock = clock
+        self.seed = seed
+        self.meta = dict(meta or {})
+        self.frame = 0
+        self.dts = []
+        self.events = []
+        self._depth = 0
+        self._patches = InstancePatches()
+        for name, (encode, _) in channels.items():
+            self._wrap(name, encode or encode_arguments)
+        self._event = clock.schedule_interval(self._on_frame, 0)
+
+    def _wrap(self, name, encode):
+        events = self.events
+
+        def make_recorded(original):
+            def recorded(*args, **kwargs):
+                if not self._depth:
+                    events.append((self.frame, name, encode(*args, **kwargs)))
+                self._depth += 1
+                try:
+                    return original(*args, **kwargs)
+                finally:
+                    self._depth -= 1
+            return recorded
+        self._patches.patch(self.game, name, make_recorded)
+
+    def _on_frame(self, dt):
+        self.frame += 1
+        self.dts.append(self.clock.frametime)
+
+    def stop(self):
+        self._event.cancel()
+        self._patches.restore()
+
+    def to_dict(self):
+        return {
+            'version': LOG_VERSION,
+            'seed': self.seed,
+            'meta': self.meta,
+            'dts': self.dts,
+            'events': self.events,
+        }
+
+    def save(self, path):
+        with open(path, 'w') as output:
+            json.dump(self.to_dict(), output)
+
+
+def load_log(path):
+    with open(path) as source:
+        log = json.load(source)
+    if log.get('version') != LOG_VERSION:
+        raise ValueError("%s is not an input log of version %i."
+                         % (path, LOG_VERSION))
+    return log
+
+
+class VirtualTime(object):
+    """
+    Replaces clock.time with a counter that only moves when advanced.
+    The clock must not limit its fps (maxfps 0), or it would sleep
+    waiting for time that never passes.
+    """
+    def __init__(self, clock):
+        self.now = clock.time()
+        self._patches = InstancePatches()
+        self._patches.patch(clock, 'time', lambda time: self.time)
+
+    def time(self):
+        return self.now
+
+    def advance(self, dt):
+        self.now += dt
+
+    def uninstall(self):
+        self._patches.restore()
+
+
+class Replayer(object):
+    """
+    Replays a log against game, which has to be in the state the
+    recording started from (usually right after init_game, with the
+    random generators seeded with log['seed']).
+    With fixed_step every frame advances the clock by fixed_step
+    instead of the recorded frame time.
+    """
+    def __init__(self, game, log, channels, clock, fixed_step=None):
+        self.game = game
+        self.log = log
+        self.clock = clock
+        self.fixed_step = fixed_step
+        self.replays = dict(
+            (name, replay or replay_arguments(name))
+            for name, (_, replay) in channels.items())
+
+    def run(self):
+        """
+        Returns the duration of every frame (tick plus the input of that
+        frame) in seconds.
+        """
+        dts = self.log['dts']
+        events = self.log['events']
+        replays = self.replays
+        game = self.game
+        tick = self.clock.tick
+        durations = np.empty(len(dts), dtype=np.float64)
+        virtual_time = VirtualTime(self.clock)
+        index = 0
+        try:
+            # Input before the first frame
+            while index < len(events) and events[index][0] == 0:
+                replays[events[index][1]](game, events[index][2])
+                index += 1
+            for frame, dt in enumerate(dts, 1):
+                virtual_time.advance(self.fixed_step or dt)
+                start = default_timer()
+                tick()
+                while index < len(events) and events[index][0] == frame:
+                    replays[events[index][1]](game, events[index][2])
+                    index += 1
+                durations[frame - 1] = default_timer() - start
+        finally:
+            virtual_time.uninstall()
+        return durations
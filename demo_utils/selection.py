@@ -0,0 +1,122 @@
+"""
+Selection sets for bulk edits.
+
+Both demos used to track one selected entity. SelectionSet holds any
+number of entity ids in selection order, fed from single clicks or from
+region queries (UniformGrid, TransformForest), and dispatches one
+on_change event per operation no matter how many entities it touched.
+The demos react to that event once (highlights, inspector) and apply
+edits to the whole set in one call, see set_selection_velocity in
+pick_object and translate_many in attachment_system.
+
+The most recently added entity is the primary one, which is what the
+single entity widgets (inspector, text inputs, camera focus) show.
+"""
+from collections import OrderedDict
+import numpy as np
+from kivy.event import EventDispatcher
+from kivy.properties import NumericProperty
+
+
+class SelectionSet(EventDispatcher):
+    """
+    on_change(added, removed) is dispatched after every operation that
+    changed the members or the primary entity, with the entity ids that
+    got added and removed (both may be empty if only the primary changed).
+    """
+    __events__ = ('on_change', )
+    count = NumericProperty(0)
+
+    def __init__(self, **kwargs):
+        super(SelectionSet, self).__init__(**kwargs)
+        self._ids = OrderedDict()
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __contains__(self, entity_id):
+        return entity_id in self._ids
+
+    def __iter__(self):
+        return iter(list(self._ids))
+
+    @property
+    def entity_ids(self):
+        return list(self._ids)
+
+    @property
+    def primary(self):
+        """
+        The most recently added entity, None if nothing is selected.
+        """
+        if not self._ids:
+            return None
+        return next(reversed(self._ids))
+
+    def as_array(self):
+        return np.fromiter(self._ids, dtype=np.intp, count=len(self._ids))
+
+    def _changed(self, primary, added, removed):
+        self.count = len(self._ids)
+        if added or removed or primary != self.primary:
+            self.dispatch('on_change', added, removed)
+
+    def add(self, entity_id):
+        """
+        Add an entity (or make it the primary one if it is selected).
+        """
+        self.add_many([entity_id])
+
+    def add_many(self, entity_ids):
+        """
+        Add entities, the last one becomes the primary entity.
+        """
+        primary = self.primary
+        ids = self._ids
+        added = []
+        for entity_id in entity_ids:
+            if entity_id in ids:
+                del ids[entity_id]
+            else:
+                added.append(entity_id)
+            ids[entity_id] = True
+        self._changed(primary, added, [])
+
+    def discard(self, entity_id):
+        self.discard_many([entity_id])
+
+    def discard_many(self, entity_ids):
+        """
+        Remove entities, ids which are not selected are ignored.
+        """
+        primary = self.primary
+        ids = self._ids
+        removed = []
+        for entity_id in entity_ids:
+            if ids.pop(entity_id, None) is not None:
+                removed.append(entity_id)
+        self._changed(primary, [], removed)
+
+    def toggle(self, entity_id):
+        if entity_id in self._ids:
+            self.discard(entity_id)
+        else:
+            self.add(entity_id)
+
+    def replace(self, entity_ids):
+        """
+        Select exactly entity_ids, with a single on_change.
+        """
+        primary = self.primary
+        old = self._ids
+        new = OrderedDict((entity_id, True) for entity_id in entity_ids)
+        removed = [entity_id for entity_id in old if entity_id not in new]
+        added = [entity_id for entity_id in new if entity_id not in old]
+        self._ids = new
+        self._changed(primary, added, removed)
+
+    def clear(self):
+        self.replace([])
+
+    def on_change(self, added, removed):
+        pass
@@ -0,0 +1,76 @@
+"""
+Instrumentation, recording and replay shared by the demos.
+
+DemoSession is mixed into the game widget of a demo. setup_session()
+(called from init_game, before any entity is created or handler bound)
+installs the zone telemetry and the system profiler and starts
+recording when RECORD_INPUT is set; finish_session() (called from
+App.on_stop) writes what the environment asks for:
+
+    PROFILE_EXPORT=some/file.json (or .csv)  per system timings
+    RECORD_INPUT=some/file.json              the input log, see
+                                             benchmarks/run.py --replay
+    ZONE_REPORT=some/file.json               zone usage, see
+                                             python -m demo_utils.telemetry
+"""
+import os
+import random
+from kivy.clock import Clock
+from kivy.core.window import Window
+from .profiling import SystemProfiler
+from .replay import InputRecorder, Replayer, seed_everything
+from .telemetry import ZoneTelemetry
+
+# Entities the spawn queue creates per frame while recording or replaying
+# input, the time budget would make spawning depend on the machine.
+REPLAY_SPAWN_BATCH = 50
+
+
+class DemoSession(object):
+    """
+    The widget needs gameworld, spawn_queue and input_channels() (the
+    handlers to record, see demo_utils.replay). random_states() returns
+    the RandomState instances seeded along with the global generators.
+    """
+    demo_name = None
+
+    def random_states(self):
+        return ()
+
+    def setup_session(self):
+        self.telemetry = ZoneTelemetry(self.gameworld)
+        self.telemetry.install()
+        self.profiler = SystemProfiler(self.gameworld)
+        self.recorder = None
+        if os.environ.get('RECORD_INPUT'):
+            self.start_recording()
+
+    def start_recording(self, seed=None):
+        if seed is None:
+            seed = random.randint(0, 2 ** 31 - 1)
+        seed_everything(seed, *self.random_states())
+        self.spawn_queue.batch_size = REPLAY_SPAWN_BATCH
+        self.recorder = InputRecorder(
+            self, self.input_channels(), Clock, seed,
+            meta={'demo': self.demo_name, 'window_size': list(Window.size),
+                  'spawn_batch': REPLAY_SPAWN_BATCH})
+
+    def prepare_replay(self, log, fixed_step=None):
+        """
+        Returns a Replayer for log, which has to be run right after
+        init_game.
+        """
+        seed_everything(log['seed'], *self.random_states())
+        self.spawn_queue.batch_size = log['meta']['spawn_batch']
+        return Replayer(self, log, self.input_channels(), Clock, fixed_step)
+
+    def finish_session(self):
+        path = os.environ.get('PROFILE_EXPORT')
+        if path and getattr(self, 'profiler', None) is not None:
+            self.profiler.export(path)
+        path = os.environ.get('RECORD_INPUT')
+        if path and getattr(self, 'recorder', None) is not None:
+            self.recorder.save(path)
+        path = os.environ.get('ZONE_REPORT')
+        if path and getattr(self, 'telemetry', None) is not None:
+            self.telemetry.export(path)
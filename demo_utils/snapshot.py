@@ -0,0 +1,109 @@
+"""
+Compact columnar scene snapshots.
+
+A snapshot is a set of named NumPy columns (one row per entity) written
+back to back into a single file:
+
+    magic (8 bytes) | header length (uint64, little endian) | JSON header
+    | padding | column 0 | padding | column 1 | ...
+
+The header lists name, dtype, shape and offset of every column plus a
+free form meta dict. Every column starts ALIGNMENT aligned, so loading
+is a single memory map of the file and every column is a view into it:
+nothing is parsed or copied until the data is actually used.
+"""
+import json
+import struct
+from collections import OrderedDict
+import numpy as np
+
+MAGIC = b'KVSNAP01'
+ALIGNMENT = 64
+
+
+def _aligned(offset):
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def save_snapshot(path, columns, meta=None):
+    """
+    Write columns ({name: array}, all with the same number of rows)
+    and an optional JSON serializable meta dict to path.
+    """
+    arrays = OrderedDict()
+    rows = None
+    for name, column in columns.items():
+        array = np.ascontiguousarray(column)
+        if array.dtype.hasobject:
+            raise TypeError("Column %r can't be stored as raw data." % name)
+        if rows is None:
+            rows = len(array)
+        elif len(array) != rows:
+            raise ValueError("Column %r has %i rows, expected %i."
+                             % (name, len(array), rows))
+        # Store little endian, so files can be shared between machines
+        arrays[name] = array.astype(array.dtype.newbyteorder('<'),
+                                    copy=False)
+    descriptions = []
+    offset = 0
+    for name, array in arrays.items():
+        descriptions.append({'name': name, 'dtype': array.dtype.str,
+                             'shape': list(array.shape), 'offset': offset})
+        offset = _aligned(offset + array.nbytes)
+    header = json.dumps({'rows': rows or 0, 'columns': descriptions,
+                         'meta': meta or {}}).encode('utf-8')
+    data_start = _aligned(len(MAGIC) + 8 + len(header))
+    with open(path, 'wb') as output:
+        output.write(MAGIC)
+        output.write(struct.pack('<Q', len(header)))
+        output.write(header)
+        for description, array in zip(descriptions, arrays.values()):
+            output.seek(data_start + description['offset'])
+            output.write(array.tobytes())
+        output.truncate(data_start + offset)
+
+
+class Snapshot(object):
+    """
+    Columns of a loaded snapshot, snapshot['position'] etc.
+    With mmap the columns are read only views into the mapped file.
+    """
+    def __init__(self, rows, columns, meta):
+        self.rows = rows
+        self.columns = columns
+        self.meta = meta
+
+    def __len__(self):
+        return self.rows
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    def __contains__(self, name):
+        return name in self.columns
+
+    def get(self, name, default=None):
+        return self.columns.get(name, default)
+
+
+def load_snapshot(path, mmap=True):
+    with open(path, 'rb') as source:
+        if source.read(len(MAGIC)) != MAGIC:
+            raise ValueError("%s is not a scene snapshot." % path)
+        header_length, = struct.unpack('<Q', source.read(8))
+        header = json.loads(source.read(header_length).decode('utf-8'))
+        data_start = _aligned(len(MAGIC) + 8 + header_length)
+        if not mmap:
+            source.seek(0)
+            data = np.frombuffer(source.read(), dtype=np.uint8)
+    if mmap:
+        data = np.memmap(path, dtype=np.uint8, mode='r')
+    columns = OrderedDict()
+    for description in header['columns']:
+        dtype = np.dtype(description['dtype'])
+        shape = tuple(description['shape'])
+        start = data_start + description['offset']
+        count = int(np.prod(shape)) if shape else 1
+        columns[description['name']] = data[
+            start:start + count * dtype.itemsize].view(dtype).reshape(shape)
+    return Snapshot(header['rows'], columns, header['meta'])
@@ -0,0 +1,225 @@
+"""
+Uniform grid spatial index over entity positions.
+
+Physics queries only find entities with a cymunk body and
+query_segment((x, y), (x, y)) only answers "what is under this point".
+UniformGrid indexes plain positions (plus an optional pick radius) and
+answers point, radius, box and lasso queries, returning every hit sorted
+by distance or z-order.
+
+Positions are stored in NumPy arrays; update() recomputes the cells of all
+given entities vectorized and only touches the cell buckets of entities
+that actually changed their cell, which is a small fraction per frame.
+"""
+import numpy as np
+
+
+class UniformGrid(object):
+    """
+    z is used for z-order sorting, higher values are on top. By default
+    every inserted entity is on top of everything inserted before.
+    """
+    def __init__(self, cell_size=64., capacity=256):
+        self.cell_size = float(cell_size)
+        self.capacity = 0
+        self.count = 0
+        self.max_radius = 0.
+        self._slots = {}
+        self._free_slots = []
+        self._cells = {}
+        self._z_counter = 0
+        self.entity_id = np.empty(0, dtype=np.intp)
+        self.x = np.empty(0, dtype=np.float64)
+        self.y = np.empty(0, dtype=np.float64)
+        self.radius = np.empty(0, dtype=np.float64)
+        self.z = np.empty(0, dtype=np.float64)
+        self.cell_x = np.empty(0, dtype=np.int64)
+        self.cell_y = np.empty(0, dtype=np.int64)
+        self._grow(max(1, capacity))
+
+    def _grow(self, capacity):
+        old = self.capacity
+        for name in ('entity_id', 'x', 'y', 'radius', 'z', 'cell_x', 'cell_y'):
+            array = getattr(self, name)
+            new = np.zeros(capacity, dtype=array.dtype)
+            new[:old] = array[:old]
+            setattr(self, name, new)
+        self.entity_id[old:] = -1
+        self._free_slots.extend(range(capacity - 1, old - 1, -1))
+        self.capacity = capacity
+
+    def __len__(self):
+        return self.count
+
+    def __contains__(self, entity_id):
+        return entity_id in self._slots
+
+    @property
+    def entity_ids(self):
+        return list(self._slots)
+
+    def _cell(self, x, y):
+        size = self.cell_size
+        return int(np.floor(x / size)), int(np.floor(y / size))
+
+    def insert(self, entity_id, x, y, radius=0., z=None):
+        if entity_id in self._slots:
+            raise ValueError("Entity %i is already indexed." % entity_id)
+        if not self._free_slots:
+            self._grow(self.capacity * 2)
+        slot = self._free_slots.pop()
+        self._slots[entity_id] = slot
+        self.entity_id[slot] = entity_id
+        self.x[slot] = x
+        self.y[slot] = y
+        self.radius[slot] = radius
+        self.max_radius = max(self.max_radius, radius)
+        if z is None:
+            z = self._z_counter
+            self._z_counter += 1
+        self.z[slot] = z
+        cell = self._cell(x, y)
+        self.cell_x[slot], self.cell_y[slot] = cell
+        self._cells.setdefault(cell, set()).add(slot)
+        self.count += 1
+
+    def remove(self, entity_id):
+        slot = self._slots.pop(entity_id)
+        cell = (int(self.cell_x[slot]), int(self.cell_y[slot]))
+        bucket = self._cells[cell]
+        bucket.discard(slot)
+        if not bucket:
+            del self._cells[cell]
+        self.entity_id[slot] = -1
+        self._free_slots.append(slot)
+        self.count -= 1
+
+    def update(self, entity_ids, xs, ys):
+        """
+        Set the positions of many entities at once.
+        """
+        slots = np.fromiter((self._slots[entity_id]
+                             for entity_id in entity_ids), dtype=np.intp)
+        if not len(slots):
+            return
+        xs = np.asarray(xs, dtype=np.float64)
+        ys = np.asarray(ys, dtype=np.float64)
+        self.x[slots] = xs
+        self.y[slots] = ys
+        size = self.cell_size
+        cell_x = np.floor(xs / size).astype(np.int64)
+        cell_y = np.floor(ys / size).astype(np.int64)
+        moved = np.flatnonzero((cell_x != self.cell_x[slots]) |
+                               (cell_y != self.cell_y[slots]))
+        cells = self._cells
+        for slot, old_x, old_y, new_x, new_y in zip(
+                slots[moved].tolist(), self.cell_x[slots[moved]].tolist(),
+                self.cell_y[slots[moved]].tolist(), cell_x[moved].tolist(),
+                cell_y[moved].tolist()):
+            bucket = cells[(old_x, old_y)]
+            bucket.discard(slot)
+            if not bucket:
+                del cells[(old_x, old_y)]
+            cells.setdefault((new_x, new_y), set()).add(slot)
+        self.cell_x[slots[moved]] = cell_x[moved]
+        self.cell_y[slots[moved]] = cell_y[moved]
+
+    def _candidates(self, x0, y0, x1, y1):
+        """
+        Slots in all cells overlapping the box.
+        """
+        cx0, cy0 = self._cell(x0, y0)
+        cx1, cy1 = self._cell(x1, y1)
+        cells = self._cells
+        found = []
+        if (cx1 - cx0 + 1) * (cy1 - cy0 + 1) > len(cells):
+            # Big area, cheaper to look at the occupied cells only
+            for (cx, cy), bucket in cells.items():
+                if cx0 <= cx <= cx1 and cy0 <= cy <= cy1:
+                    found.extend(bucket)
+        else:
+            for cx in range(cx0, cx1 + 1):
+                for cy in range(cy0, cy1 + 1):
+                    bucket = cells.get((cx, cy))
+                    if bucket:
+                        found.extend(bucket)
+        return np.array(found, dtype=np.intp)
+
+    def _result(self, slots, order, origin):
+        if order == 'distance':
+            dx = self.x[slots] - origin[0]
+            dy = self.y[slots] - origin[1]
+            slots = slots[np.argsort(dx * dx + dy * dy, kind='stable')]
+        elif order == 'z':
+            slots = slots[np.argsort(-self.z[slots], kind='stable')]
+        elif order is not None:
+            raise ValueError("Unknown order %r." % (order, ))
+        return self.entity_id[slots].tolist()
+
+    def query_point(self, x, y, order='z'):
+        """
+        Entities whose pick radius covers the point.
+        Topmost first by default.
+        """
+        reach = self.max_radius
+        slots = self._candidates(x - reach, y - reach, x + reach, y + reach)
+        dx = self.x[slots] - x
+        dy = self.y[slots] - y
+        radius = self.radius[slots]
+        slots = slots[dx * dx + dy * dy <= radius * radius]
+        return self._result(slots, order, (x, y))
+
+    def query_radius(self, x, y, r, order='distance'):
+        """
+        Entities whose pick circle intersects the circle at x, y.
+        Nearest first by default.
+        """
+        reach = r + self.max_radius
+        slots = self._candidates(x - reach, y - reach, x + reach, y + reach)
+        dx = self.x[slots] - x
+        dy = self.y[slots] - y
+        reach = r + self.radius[slots]
+        slots = slots[dx * dx + dy * dy <= reach * reach]
+        return self._result(slots, order, (x, y))
+
+    def query_box(self, x0, y0, x1, y1, order='z'):
+        """
+        Entities with their position inside the box.
+        """
+        x0, x1 = min(x0, x1), max(x0, x1)
+        y0, y1 = min(y0, y1), max(y0, y1)
+        slots = self._candidates(x0, y0, x1, y1)
+        x = self.x[slots]
+        y = self.y[slots]
+        slots = slots[(x >= x0) & (x <= x1) & (y >= y0) & (y <= y1)]
+        return self._result(slots, order,
+                            ((x0 + x1) * .5, (y0 + y1) * .5))
+
+    def query_lasso(self, points, order='z'):
+        """
+        Entities with their position inside the polygon given by points.
+        """
+        polygon = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        if len(polygon) < 3:
+            return []
+        (x0, y0), (x1, y1) = polygon.min(axis=0), polygon.max(axis=0)
+        slots = self._candidates(x0, y0, x1, y1)
+        slots = slots[points_in_polygon(self.x[slots], self.y[slots],
+                                        polygon)]
+        return self._result(slots, order, polygon.mean(axis=0))
+
+
+def points_in_polygon(xs, ys, polygon):
+    """
+    Even-odd rule test of many points against one polygon.
+    """
+    inside = np.zeros(len(xs), dtype=bool)
+    ax, ay = polygon[-1]
+    for bx, by in polygon:
+        crosses = (ay > ys) != (by > ys)
+        if crosses.any():
+            with np.errstate(divide='ignore', invalid='ignore'):
+                at_x = ax + (ys - ay) * (bx - ax) / (by - ay)
+            inside ^= crosses & (xs < at_x)
+        ax, ay = bx, by
+    return inside
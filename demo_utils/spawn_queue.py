@@ -0,0 +1,127 @@
+"""
+Frame budgeted entity creation.
+
+Creating a big batch of entities in one callback stalls the frame for as
+long as the batch takes. SpawnQueue collects spawn requests instead and
+creates as many entities per frame as fit into a time budget, so large
+spawns turn into a short ramp over several frames.
+"""
+import heapq
+from itertools import count
+from timeit import default_timer
+from kivy.clock import Clock
+from kivy.event import EventDispatcher
+from kivy.properties import NumericProperty
+
+
+class SpawnRequest(object):
+    __slots__ = ('spawn', 'remaining', 'callback', 'entity_ids')
+
+    def __init__(self, spawn, remaining, callback):
+        self.spawn = spawn
+        self.remaining = remaining
+        self.callback = callback
+        self.entity_ids = []
+
+
+class SpawnQueue(EventDispatcher):
+    """
+    spawn(n) callables are called with the number of entities to create
+    and have to return the new entity ids. Requests with a higher priority
+    are drained first, requests with the same priority in order.
+    
+    depth is the number of entities still waiting to be created.
+    With batch_size set, exactly that many entities are created per frame
+    regardless of the budget, which makes the spawning deterministic
+    (see demo_utils.replay).
+    """
+    budget = NumericProperty(.004)
+    batch_size = NumericProperty(0)
+    depth = NumericProperty(0)
+    # Entities created in the last frame
+    spawned = NumericProperty(0)
+
+    def __init__(self, **kwargs):
+        super(SpawnQueue, self).__init__(**kwargs)
+        self._heap = []
+        self._counter = count()
+        self._event = None
+        # Running estimate of the seconds one entity takes to create
+        self._cost = None
+
+    def submit(self, spawn, n=1, priority=0, callback=None):
+        """
+        Queue the creation of n entities with spawn.
+        callback(entity_ids) is called once all of them exist.
+        """
+        if n <= 0:
+            return
+        request = SpawnRequest(spawn, n, callback)
+        heapq.heappush(self._heap, (-priority, next(self._counter), request))
+        self.depth += n
+        if self._event is None:
+            self._event = Clock.schedule_interval(self._drain, 0)
+        return request
+
+    def clear(self):
+        """
+        Drop all pending requests.
+        """
+        del self._heap[:]
+        self.depth = 0
+
+    def flush(self):
+        """
+        Create everything pending right now, ignoring the budget.
+        """
+        while self._heap:
+            self._spawn(self._heap[0][2], self._heap[0][2].remaining)
+
+    def _spawn(self, request, n):
+        start = default_timer()
+        entity_ids = request.spawn(n)
+        elapsed = default_timer() - start
+        per_entity = elapsed / n
+        self._cost = (per_entity if self._cost is None
+                      else .8 * self._cost + .2 * per_entity)
+        request.entity_ids.extend(entity_ids)
+        request.remaining -= n
+        self.depth -= n
+        if request.remaining <= 0:
+            heapq.heappop(self._heap)
+            if request.callback is not None:
+                request.callback(request.entity_ids)
+        return n
+
+    def _drain(self, dt):
+        heap = self._heap
+        spawned = 0
+        if self.batch_size:
+            while heap and spawned < self.batch_size:
+                request = heap[0][2]
+                spawned += self._spawn(
+                    request,
+                    min(request.remaining, self.batch_size - spawned))
+            self._finish_drain(spawned)
+            return
+        deadline = default_timer() + self.budget
+        while heap:
+            request = heap[0][2]
+            left = deadline - default_timer()
+            if left <= 0 and spawned:
+                break
+            if self._cost is None:
+                n = 1
+            else:
+                n = int(left / self._cost) if left > 0 else 0
+            # Always make some progress, even if the budget is too small
+            # for a single entity.
+            n = max(1, min(request.remaining, n))
+            spawned += self._spawn(request, n)
+        self._finish_drain(spawned)
+
+    def _finish_drain(self, spawned):
+        self.spawned = spawned
+        if not self._heap:
+            self._event.cancel()
+            self._event = None
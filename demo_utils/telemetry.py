@@ -0,0 +1,240 @@
+"""
+Zone capacity telemetry and sizing advice.
+
+The kv files fix size_of_gameworld, the zone sizes and the block and
+batch sizes up front; kivent reserves all of that memory at startup and
+entity creation fails once a zone is full. ZoneTelemetry follows entity
+creation and removal (wrapping init_entity and remove_entity of the
+gameworld, see demo_utils.patching) and tracks the live
+slots and high-water marks per zone and per system, next to the
+configured capacities.
+
+report() is a plain dict that can be exported as JSON after a
+representative run (a replayed session for instance, see
+demo_utils.replay). advise(report) turns the high-water marks into
+tight settings:
+
+    python -m demo_utils.telemetry zone_report.json [--headroom .2]
+"""
+from __future__ import print_function
+import json
+import math
+from collections import defaultdict
+from .patching import InstancePatches
+
+KIB = 1024
+
+
+class ZoneTelemetry(object):
+    def __init__(self, gameworld):
+        self.gameworld = gameworld
+        self._entities = {}
+        self.zone_live = defaultdict(int)
+        self.zone_peak = defaultdict(int)
+        self.system_live = defaultdict(int)
+        self.system_peak = defaultdict(int)
+        self.created = 0
+        self.removed = 0
+        self.failed = 0
+        self._patches = InstancePatches()
+
+    def install(self):
+        if len(self._patches):
+            return
+
+        def track_init_entity(init_entity):
+            def tracked_init_entity(components, component_order,
+                                    zone='general', *args, **kwargs):
+                try:
+                    entity_id = init_entity(components, component_order,
+                                            zone, *args, **kwargs)
+                except Exception:
+                    self.failed += 1
+                    raise
+                self.add(entity_id, zone, component_order)
+                return entity_id
+            return tracked_init_entity
+
+        def track_remove_entity(remove_entity):
+            def tracked_remove_entity(entity_id, *args, **kwargs):
+                result = remove_entity(entity_id, *args, **kwargs)
+                self.forget(entity_id)
+                return result
+            return tracked_remove_entity
+        self._patches.patch(self.gameworld, 'init_entity', track_init_entity)
+        self._patches.patch(self.gameworld, 'remove_entity',
+                            track_remove_entity)
+
+    def uninstall(self):
+        self._patches.restore()
+
+    def add(self, entity_id, zone, system_ids):
+        """
+        Count an entity created in zone with components of system_ids.
+        """
+        system_ids = tuple(system_ids)
+        self._entities[entity_id] = (zone, system_ids)
+        self.created += 1
+        live = self.zone_live[zone] = self.zone_live[zone] + 1
+        if live > self.zone_peak[zone]:
+            self.zone_peak[zone] = live
+        system_live = self.system_live
+        system_peak = self.system_peak
+        for system_id in system_ids:
+            live = system_live[system_id] = system_live[system_id] + 1
+            if live > system_peak[system_id]:
+                system_peak[system_id] = live
+
+    def forget(self, entity_id):
+        """
+        Stop counting an entity. Removals that don't go through
+        gameworld.remove_entity (e.g. a whole attachment subtree) have
+        to be reported here; unknown entity ids are ignored.
+        """
+        entry = self._entities.pop(entity_id, None)
+        if entry is None:
+            return
+        zone, system_ids = entry
+        self.removed += 1
+        self.zone_live[zone] -= 1
+        for system_id in system_ids:
+            self.system_live[system_id] -= 1
+
+    def _systems(self):
+        systems = self.gameworld.system_manager.systems
+        return [system for system in systems if system is not None]
+
+    def report(self):
+        """
+        Configuration and usage as a JSON serializable dict. Component
+        sizes (and therefore bytes) are only known for systems exposing
+        type_size.
+        """
+        gameworld = self.gameworld
+        zones = dict(gameworld.zones)
+        report = {
+            'size_of_gameworld_kib': gameworld.size_of_gameworld,
+            'created': self.created,
+            'removed': self.removed,
+            'failed': self.failed,
+            'zones': dict((zone, {
+                'capacity': capacity,
+                'live': self.zone_live[zone],
+                'peak': self.zone_peak[zone],
+            }) for zone, capacity in zones.items()),
+            'systems': {},
+        }
+        reserved_total = used_total = 0
+        for system in self._systems():
+            system_id = system.system_id
+            system_zones = list(getattr(system, 'zones', None) or [])
+            capacity = sum(zones.get(zone, 0) for zone in system_zones)
+            entry = {
+                'zones': system_zones,
+                'capacity': capacity,
+                'live': self.system_live[system_id],
+                'peak': self.system_peak[system_id],
+            }
+            for name in ('size_of_component_block', 'size_of_batches',
+                         'max_batches', 'frame_count'):
+                value = getattr(system, name, None)
+                if value is not None:
+                    entry[name] = value
+            type_size = getattr(system, 'type_size', None)
+            if type_size:
+                entry['type_size'] = type_size
+                entry['reserved_bytes'] = capacity * type_size
+                entry['used_bytes'] = entry['live'] * type_size
+                entry['peak_bytes'] = entry['peak'] * type_size
+                reserved_total += entry['reserved_bytes']
+                used_total += entry['used_bytes']
+            report['systems'][system_id] = entry
+        report['component_reserved_bytes'] = reserved_total
+        report['component_used_bytes'] = used_total
+        return report
+
+    def export(self, path):
+        with open(path, 'w') as output:
+            json.dump(self.report(), output, indent=2, sort_keys=True)
+
+    def format_table(self):
+        report = self.report()
+        lines = ['%-12s %8s %8s %8s' % ('zone', 'live', 'peak', 'capacity')]
+        for zone, entry in sorted(report['zones'].items()):
+            lines.append('%-12s %8i %8i %8i' % (
+                zone, entry['live'], entry['peak'], entry['capacity']))
+        return '\n'.join(lines)
+
+
+def advise(report, headroom=.2, minimum=16):
+    """
+    Suggest settings from a report: every zone gets its high-water mark
+    plus headroom (rounded up to whole component blocks where the block
+    size is known). size_of_gameworld is dominated by the per zone
+    component storage, so it is scaled by the same factor as the zones.
+    Returns a dict of the suggested values and the reasoning per value.
+    """
+    zones = {}
+    notes = []
+    block_entities = []
+    for entry in report['systems'].values():
+        if entry.get('type_size') and entry.get('size_of_component_block'):
+            block_entities.append(
+                int(entry['size_of_component_block'] * KIB //
+                    entry['type_size']))
+    # The zone has to be a multiple of the component blocks of every
+    # system; the biggest block is a good enough approximation.
+    granularity = max(block_entities) if block_entities else 1
+    configured = suggested = 0
+    for zone, entry in sorted(report['zones'].items()):
+        size = max(minimum, int(math.ceil(entry['peak'] * (1. + headroom))))
+        size = int(math.ceil(float(size) / granularity)) * granularity
+        zones[zone] = size
+        configured += entry['capacity']
+        suggested += size
+        notes.append('zone %r: peak %i of %i slots -> %i' % (
+            zone, entry['peak'], entry['capacity'], size))
+        if entry['peak'] >= entry['capacity']:
+            notes.append('zone %r was full, entity creation may have '
+                         'failed (%i failures)' % (zone, report['failed']))
+    size_of_gameworld = report['size_of_gameworld_kib']
+    if configured:
+        size_of_gameworld = int(math.ceil(
+            size_of_gameworld * float(suggested) / configured))
+    notes.append('size_of_gameworld: %i KiB -> %i KiB' % (
+        report['size_of_gameworld_kib'], size_of_gameworld))
+    for system_id, entry in sorted(report['systems'].items()):
+        if 'reserved_bytes' in entry:
+            notes.append('%s: %i of %i component bytes used at peak' % (
+                system_id, entry['peak_bytes'], entry['reserved_bytes']))
+    return {
+        'zones': zones,
+        'size_of_gameworld': size_of_gameworld,
+        'notes': notes,
+    }
+
+
+def format_kv(advice):
+    zones = ', '.join('%r: %i' % item for item in sorted(
+        advice['zones'].items()))
+    return 'size_of_gameworld: %i\nzones: {%s}' % (
+        advice['size_of_gameworld'], zones)
+
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(
+        description='Suggest GameWorld sizes from a zone report.')
+    parser.add_argument('report')
+    parser.add_argument('--headroom', type=float, default=.2)
+    args = parser.parse_args(argv)
+    with open(args.report) as source:
+        advice = advise(json.load(source), args.headroom)
+    for note in advice['notes']:
+        print(note)
+    print()
+    print(format_kv(advice))
+
+
+if __name__ == '__main__':
+    main()
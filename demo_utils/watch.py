@@ -0,0 +1,167 @@
+"""
+Event driven entity inspection.
+
+Polling a selected entity and rebuilding its property tuples on a timer
+costs the same whether anything changed or not, and only works for one
+entity. EntityWatcher keeps the watched values of any number of entities
+in preallocated NumPy arrays, reads them at a configurable rate, and
+dispatches a single on_change event per poll listing the entities whose
+values moved by more than the tolerance. Nothing is dispatched (and no
+lists are built) while the watched entities stand still.
+"""
+import numpy as np
+from kivy.clock import Clock
+from kivy.event import EventDispatcher
+from kivy.properties import NumericProperty
+
+
+class EntityWatcher(EventDispatcher):
+    """
+    read(entity_ids, values) has to write the current values of the
+    given entities into the rows of values (len(entity_ids) x
+    len(fields)), in place.
+
+    tolerance is either one value or one per field. on_change(entity_ids)
+    is dispatched with the entities that changed since the last poll,
+    see changed_fields for what changed. Newly watched entities are
+    always reported on the next poll.
+
+    rate is the number of polls per second, 0 polls every frame.
+    """
+    __events__ = ('on_change', )
+    rate = NumericProperty(10)
+
+    def __init__(self, read, fields, tolerance=0., capacity=64, **kwargs):
+        self._event = None
+        super(EntityWatcher, self).__init__(**kwargs)
+        self.read = read
+        self.fields = tuple(fields)
+        self._field_index = dict((name, i)
+                                 for i, name in enumerate(self.fields))
+        self.tolerance = np.broadcast_to(
+            np.asarray(tolerance, dtype=np.float64), (len(self.fields), ))
+        self.count = 0
+        self.capacity = 0
+        self._ids = []
+        self._rows = {}
+        self._current = np.empty((0, len(self.fields)))
+        self._last = np.empty((0, len(self.fields)))
+        self._delta = np.empty((0, len(self.fields)))
+        self._changed = np.empty((0, len(self.fields)), dtype=bool)
+        self.refresh = Clock.create_trigger(self.poll)
+        self._grow(max(1, capacity))
+
+    def _grow(self, capacity):
+        count = self.count
+        for name, dtype in (('_current', np.float64), ('_last', np.float64),
+                            ('_delta', np.float64), ('_changed', bool)):
+            array = np.zeros((capacity, len(self.fields)), dtype=dtype)
+            array[:count] = getattr(self, name)[:count]
+            setattr(self, name, array)
+        self.capacity = capacity
+
+    def __len__(self):
+        return self.count
+
+    def __contains__(self, entity_id):
+        return entity_id in self._rows
+
+    @property
+    def entity_ids(self):
+        return list(self._ids)
+
+    def watch(self, entity_id):
+        if entity_id in self._rows:
+            return
+        if self.count == self.capacity:
+            self._grow(self.capacity * 2)
+        row = self.count
+        self._rows[entity_id] = row
+        self._ids.append(entity_id)
+        # Differs from everything, so the entity gets reported first poll
+        self._last[row] = np.inf
+        self._changed[row] = False
+        self.count += 1
+        if self._event is None:
+            self._schedule()
+        self.refresh()
+
+    def watch_many(self, entity_ids):
+        for entity_id in entity_ids:
+            self.watch(entity_id)
+
+    def unwatch(self, entity_id):
+        row = self._rows.pop(entity_id, None)
+        if row is None:
+            return
+        # Move the last row into the gap to keep the rows contiguous
+        last = self.count - 1
+        if row != last:
+            moved_id = self._ids[last]
+            self._ids[row] = moved_id
+            self._rows[moved_id] = row
+            for array in (self._current, self._last, self._changed):
+                array[row] = array[last]
+        self._ids.pop()
+        self.count = last
+        if not last:
+            self._unschedule()
+
+    def clear(self):
+        self._rows.clear()
+        del self._ids[:]
+        self.count = 0
+        self._unschedule()
+
+    def get(self, entity_id):
+        """
+        The values of entity_id as of the last poll, in field order.
+        """
+        return tuple(self._last[self._rows[entity_id]].tolist())
+
+    def value(self, entity_id, field):
+        return float(self._last[self._rows[entity_id],
+                                self._field_index[field]])
+
+    def changed_fields(self, entity_id):
+        """
+        Names of the fields of entity_id changed by the last poll.
+        """
+        changed = self._changed[self._rows[entity_id]]
+        return [name for name, flag in zip(self.fields, changed) if flag]
+
+    def _schedule(self):
+        self._event = Clock.schedule_interval(
+            self.poll, 1. / self.rate if self.rate else 0)
+
+    def _unschedule(self):
+        if self._event is not None:
+            self._event.cancel()
+            self._event = None
+
+    def on_rate(self, _, value):
+        if self._event is not None:
+            self._unschedule()
+            self._schedule()
+
+    def poll(self, dt=None):
+        count = self.count
+        if not count:
+            return
+        current = self._current[:count]
+        last = self._last[:count]
+        delta = self._delta[:count]
+        changed = self._changed[:count]
+        self.read(self._ids, current)
+        np.subtract(current, last, out=delta)
+        np.abs(delta, out=delta)
+        np.greater(delta, self.tolerance, out=changed)
+        rows = np.flatnonzero(changed.any(axis=1))
+        if not len(rows):
+            return
+        last[rows] = current[rows]
+        ids = self._ids
+        self.dispatch('on_change', [ids[row] for row in rows.tolist()])
+
+    def on_change(self, entity_ids):
+        pass
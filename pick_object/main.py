@@ -1,3 +1,6 @@
+import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
 from kivy.app import App
 from kivy.uix.widget import Widget
 from kivy.clock import Clock
@@ -11,16 +14,131 @@ from kivent_core.managers.resource_managers import texture_manager
 from kivent_core.systems.renderers import RotateRenderer
 from kivent_core.systems.position_systems import PositionSystem2D
 from kivent_core.systems.rotate_systems import RotateSystem2D
-from kivy.properties import StringProperty, NumericProperty
+from kivy.properties import StringProperty, NumericProperty, BooleanProperty
 from functools import partial
+from collections import OrderedDict
+from timeit import default_timer
+import numpy as np
+from pooling import (PrefabRegistry, EntityPool, add_to_space,
+                     remove_from_space)
+from demo_utils.spawn_queue import SpawnQueue
+from demo_utils.spatial import UniformGrid
+from demo_utils.culling import FrustumCuller
+from demo_utils.snapshot import save_snapshot, load_snapshot
+from demo_utils.watch import EntityWatcher
+from demo_utils.selection import SelectionSet
+from demo_utils.assets import AssetCatalog
+from demo_utils.session import DemoSession
 
 
-texture_manager.load_atlas('assets/background_objects.atlas')
+# Only the texture names are registered here, atlas pages get loaded when
+# the first asteroid needs them. python -m demo_utils.assets pick_object
+# packs the assets into assets/atlas, which is preferred if it exists.
+ASSETS = AssetCatalog(texture_manager)
+ASSETS.discover('assets/atlas', 'assets')
+ASTEROID_TEXTURE = 'asteroid1'
 
 
-class TestGame(Widget):
+# Radius (in pixels) around an asteroid's position that counts as a hit.
+ASTEROID_PICK_RADIUS = 22
+
+# Integer ranges (inclusive, like randint) the random asteroid values are
+# drawn from. Angles are in degrees.
+ASTEROID_DISTRIBUTIONS = {
+    'velocity': (-250, 250),
+    'angle': (-360, 360),
+    'angular_velocity': (-150, -150),
+}
+
+
+def create_asteroid_template():
+    """
+    Returns the (component dict, component order) used to create asteroids.
+    init_entity only reads the dicts, so one template can be reused for
+    every asteroid by just replacing the per entity values (setup_asteroid).
+    """
+    shape_dict = {'inner_radius': 0, 'outer_radius': 22, 
+        'mass': 50, 'offset': (0, 0)}
+    col_shape = {'shape_type': 'circle', 'elasticity': .5, 
+        'collision_type': 1, 'shape_info': shape_dict, 'friction': 1.0}
+    col_shapes = [col_shape]
+    physics_component = {'main_shape': 'circle', 
+        'velocity': (0, 0), 
+        'position': (0, 0), 'angle': 0, 
+        'angular_velocity': 0, 
+        'vel_limit': 500, 
+        'ang_vel_limit': radians(200), 
+        'mass': 50, 'col_shapes': col_shapes}
+    create_component_dict = {'cymunk_physics': physics_component, 
+        'rotate_color_renderer': {
+            'texture': ASTEROID_TEXTURE,
+            'size': (45, 45),
+            'render': True
+        },
+        'color': (255,255,255,255),
+        'position': (0, 0), 'rotate': 0, }
+    component_order = ['position', 'rotate', 'color', 'rotate_color_renderer', 
+        'cymunk_physics',]
+    return create_component_dict, component_order
+
+
+def setup_asteroid(create_component_dict, x, y, x_vel, y_vel, angle,
+                   angular_velocity):
+    physics_component = create_component_dict['cymunk_physics']
+    pos = (x, y)
+    physics_component['position'] = pos
+    physics_component['velocity'] = (x_vel, y_vel)
+    physics_component['angle'] = angle
+    physics_component['angular_velocity'] = angular_velocity
+    create_component_dict['position'] = pos
+
+
+def restore_asteroid(entity, x, y, x_vel, y_vel, angle, angular_velocity):
+    """
+    Same as setup_asteroid, but for an existing (pooled) asteroid.
+    """
+    body = entity.cymunk_physics.body
+    body.position = (x, y)
+    body.velocity = (x_vel, y_vel)
+    body.angle = angle
+    body.angular_velocity = angular_velocity
+    body.reset_forces()
+    entity.position.x = x
+    entity.position.y = y
+    entity.rotate.r = angle
+    entity.color.rgba = (255,255,255,255)
+
+# Values shown for the selected asteroid. Positions are displayed as
+# integers, so smaller moves don't need an update.
+INSPECTOR_FIELDS = ('x', 'y', 'vx', 'vy')
+INSPECTOR_TOLERANCE = (.5, .5, 1e-6, 1e-6)
+
+class TestGame(DemoSession, Widget):
+    demo_name = 'pick_object'
+
     def __init__(self, **kwargs):
         super(TestGame, self).__init__(**kwargs)
+        self._rng = np.random.RandomState()
+        self.prefabs = PrefabRegistry()
+        self.prefabs.register('asteroid', *create_asteroid_template(),
+                              setup=setup_asteroid, restore=restore_asteroid)
+        # Destroyed asteroids are parked here and reused by spawn_asteroids
+        self.pool = EntityPool(self.gameworld, self.prefabs)
+        # Spreads big spawns over several frames
+        self.spawn_queue = SpawnQueue()
+        # Positions of all asteroids for picking, see pick()
+        self.pick_index = UniformGrid(cell_size=64)
+        self._pick_index_frame = None
+        # Entities per second of the last spawn_asteroids call
+        self.spawn_rate = 0
+        # Pushes position and velocity changes of watched asteroids
+        self.inspector = EntityWatcher(self._read_inspected, INSPECTOR_FIELDS,
+                                       INSPECTOR_TOLERANCE)
+        # Selected asteroids, the bulk edits below apply to all of them.
+        # Highlighting zeroes the red channel, the original one is kept
+        # here.
+        self.selection = SelectionSet()
+        self._unselected_red = {}
         self.gameworld.init_gameworld(
             ['cymunk_physics', 'rotate_color_renderer', 'rotate', 'color', 'position',
             'camera1'],
@@ -29,10 +147,49 @@ class TestGame(Widget):
     def init_game(self):
         self.setup_states()
         self.set_state()
+        # Telemetry, profiler and input recording, see demo_utils.session.
+        # Has to happen before the handlers get bound.
+        self.setup_session()
         # set up click event
         self.ids.gameworld.bind(on_touch_down=self.on_mouse_click)
         # lol, we need this to stop clicks on our GUI to deselect the current asteroid 
         self._btn_pane = self.ids.gamescreenmanager.ids.main_screen.ids.bottom_pane
+        self.spawn_queue.bind(depth=self.app.setter('queued'))
+        self.inspector.bind(on_change=self.app.on_inspector_change)
+        self.selection.bind(on_change=self.on_selection_change,
+                            count=self.app.setter('selected_count'))
+        # Off screen asteroids are neither rendered nor simulated: their
+        # bodies leave the space like parked ones (see pooling), so
+        # chipmunk's sleeping stays disabled and costs nothing per step.
+        self.culler = FrustumCuller(
+            self.pick_index, self._read_positions, self._uncull_asteroids,
+            self._cull_asteroids, margin=64, hysteresis=64)
+        # Time every system update, shown in the profile overlay
+        self.profiler.install(['position', 'rotate', 'color', 'cymunk_physics',
+                               'rotate_color_renderer', 'camera1'])
+        Clock.schedule_interval(
+            self.profiler.wrap('culling', self.update_culling), 0)
+
+    def input_channels(self):
+        """
+        The handlers recorded by start_recording, see demo_utils.replay.
+        """
+        return {
+            'click_at': (None, None),
+            'select_entities': (None, None),
+            'select_visible': (None, None),
+            'draw_some_stuff': (None, None),
+            'set_asteroid_velocity': (None, None),
+            'destroy_asteroid': (None, None),
+            'set_selection_velocity': (None, None),
+            'scale_selection_velocity': (None, None),
+            'zero_selection_forces': (None, None),
+            'recolor_selection': (None, None),
+            'destroy_selection': (None, None),
+        }
+
+    def random_states(self):
+        return (self._rng, )
 
     def setup_states(self):
         self.gameworld.add_state(state_name='main', 
@@ -46,99 +203,372 @@ class TestGame(Widget):
         
 
     def on_mouse_click(self, etype, event):
+        # Shift adds to (or removes from) the selection
+        self.click_at(event.pos, 'shift' in Window.modifiers)
+
+    def click_at(self, pos, additive=False):
         # Check if we clicked the bottom pane.
         # A better way would be to make the "game viewport" smaller and
         # don't just overlay our GUI, but i failed to do this so far, so...
-        if self._btn_pane.collide_point(*event.pos):
+        if self._btn_pane.collide_point(*pos):
             return
-        
+        x, y = self.screen_to_world(pos)
+        # Topmost asteroid under the cursor. Use select_radius, select_box
+        # or select_lasso with select_entities to select regions.
+        hits = self.pick(x, y)
+        if not additive:
+            self.selection.replace(hits[:1])
+        elif hits:
+            self.selection.toggle(hits[0])
+
+    def select_entities(self, entity_ids, additive=False):
+        """
+        Select the result of a region query, e.g.
+        select_entities(select_radius(x, y, 200)).
+        """
+        if additive:
+            self.selection.add_many(entity_ids)
+        else:
+            self.selection.replace(entity_ids)
+
+    def select_visible(self, additive=False):
+        self.select_entities(self.select_box(*self.get_camera_region()),
+                             additive)
+
+    def on_selection_change(self, selection, added, removed):
         entities = self.gameworld.entities
+        unselected_red = self._unselected_red
+        for entity_id in removed:
+            red = unselected_red.pop(entity_id)
+            if entity_id in self.pick_index:
+                entities[entity_id].color.r = red
+        for entity_id in added:
+            color = entities[entity_id].color
+            unselected_red[entity_id] = color.r
+            color.r = 0
+        primary = selection.primary
+        self.app.selected_id = primary
+        # Only follow single asteroids with the camera
         gameview = self.gameworld.system_manager['camera1']
-                
-        if not self.app.selected_id is None:
-            ent = entities[self.app.selected_id]
-            ent.color.r = 255   
-                             
-        # We need to handle scrolling offsets (TODO: zoom/scale)
-        x, y = event.pos
-        x = x - gameview.camera_pos[0]
-        y = y - gameview.camera_pos[1]        
-        physics = self.gameworld.system_manager['cymunk_physics']
-        # if you want to select a region use physics.query_bb(...)
-        hits = physics.query_segment((x,y), (x,y))
-        if len(hits) > 0:            
-            ent = entities[hits[0][0]]
-            ent.color.r = 0
-            self.app.selected_id = ent.entity_id
-            gameview.entity_to_focus = ent.entity_id
+        if len(selection) == 1:
+            gameview.entity_to_focus = primary
             gameview.focus_entity = True
         else:
-            self.app.selected = None            
             gameview.focus_entity = False
 
+    def screen_to_world(self, pos):
+        """
+        Convert a window position to world coordinates,
+        handling both camera scrolling and zoom.
+        """
+        gameview = self.gameworld.system_manager['camera1']
+        scale = gameview.camera_scale
+        return ((pos[0] - gameview.x) * scale - gameview.camera_pos[0],
+                (pos[1] - gameview.y) * scale - gameview.camera_pos[1])
+
+    def _read_inspected(self, entity_ids, values):
+        entities = self.gameworld.entities
+        for row, entity_id in enumerate(entity_ids):
+            entity = entities[entity_id]
+            position = entity.position
+            velocity = entity.cymunk_physics.body.velocity
+            values[row, 0] = position.x
+            values[row, 1] = position.y
+            values[row, 2] = velocity.x
+            values[row, 3] = velocity.y
+
+    def _read_positions(self, entity_ids):
+        entities = self.gameworld.entities
+        positions = [entities[entity_id].position for entity_id in entity_ids]
+        return ([position.x for position in positions],
+                [position.y for position in positions])
+
+    def _refresh_pick_index(self):
+        # Positions only need to be synced once per frame, and only if
+        # someone actually queries the index. Culled asteroids are out of
+        # the space, so only the active ones can have moved.
+        if self._pick_index_frame == Clock.frames:
+            return
+        self._pick_index_frame = Clock.frames
+        entity_ids = list(self.culler.active)
+        xs, ys = self._read_positions(entity_ids)
+        self.pick_index.update(entity_ids, xs, ys)
+
+    def _cull_asteroids(self, entity_ids):
+        entities = self.gameworld.entities
+        space = self.pool.space
+        for entity_id in entity_ids:
+            entity = entities[entity_id]
+            entity.rotate_color_renderer.render = False
+            remove_from_space(space, entity.cymunk_physics)
+
+    def _uncull_asteroids(self, entity_ids):
+        entities = self.gameworld.entities
+        space = self.pool.space
+        for entity_id in entity_ids:
+            entity = entities[entity_id]
+            add_to_space(space, entity.cymunk_physics)
+            entity.rotate_color_renderer.render = True
+
+    def update_culling(self, dt):
+        culler = self.culler
+        culler.update(self.get_camera_region())
+        self.app.visible = culler.visible_count
+        self.app.active = culler.active_count
+
+    def pick(self, x, y):
+        """
+        All asteroids under the world position x, y, topmost first.
+        """
+        self._refresh_pick_index()
+        return self.pick_index.query_point(x, y)
+
+    def select_radius(self, x, y, radius, order='distance'):
+        self._refresh_pick_index()
+        return self.pick_index.query_radius(x, y, radius, order)
+
+    def select_box(self, x0, y0, x1, y1, order='z'):
+        self._refresh_pick_index()
+        return self.pick_index.query_box(x0, y0, x1, y1, order)
+
+    def select_lasso(self, points, order='z'):
+        """
+        points is the outline of the lasso in world coordinates.
+        """
+        self._refresh_pick_index()
+        return self.pick_index.query_lasso(points, order)
+
         
-    def draw_some_stuff(self):
+    def get_camera_region(self):
+        """
+        Returns the (left, bottom, right, top) world coordinates
+        currently visible through camera1.
+        """
         gameview = self.gameworld.system_manager['camera1']
+        scale = gameview.camera_scale
         x, y = int(-gameview.camera_pos[0]), int(-gameview.camera_pos[1])
-        w, h =  int(gameview.size[0] + x), int(gameview.size[1] + y)
-        create_asteroid = self.create_asteroid
-        for i in range(100):
-            pos = (randint(x, w), randint(y, h))
-            ent_id = create_asteroid(pos)
-        self.app.count += 100
+        w = int(gameview.size[0] * scale + x)
+        h = int(gameview.size[1] * scale + y)
+        return (x, y, w, h)
+
+    def draw_some_stuff(self, n=100, priority=0):
+        # Fix the region now, the camera might move until the queue
+        # gets to this request.
+        spawn = partial(self.spawn_asteroids,
+                        region=self.get_camera_region())
+        self.spawn_queue.submit(spawn, n, priority)
+
+    def spawn_asteroids(self, n, region=None, distributions=None):
+        """
+        Create n asteroids at random positions inside region
+        (left, bottom, right, top), the camera rectangle by default.
+        distributions can override the ranges in ASTEROID_DISTRIBUTIONS.
+        
+        All random values are drawn as arrays up front and every entity is
+        created from the same component template, so the only per entity
+        work left is init_entity itself.
+        Returns the new entity ids.
+        """
+        start = default_timer()
+        if region is None:
+            region = self.get_camera_region()
+        x, y, w, h = region
+        ranges = dict(ASTEROID_DISTRIBUTIONS)
+        if distributions:
+            ranges.update(distributions)
+        rng = self._rng
+
+        def draw(name):
+            low, high = ranges[name]
+            return rng.randint(low, high + 1, n)
+
+        xs = rng.randint(x, w + 1, n)
+        ys = rng.randint(y, h + 1, n)
+        x_vels = draw('velocity')
+        y_vels = draw('velocity')
+        angles = np.radians(draw('angle'))
+        angular_velocities = np.radians(draw('angular_velocity'))
+        entity_ids = self._init_asteroids(xs, ys, x_vels, y_vels, angles,
+                                          angular_velocities)
+        elapsed = default_timer() - start
+        if elapsed > 0:
+            self.spawn_rate = n / elapsed
+        return entity_ids
+
+    def _init_asteroids(self, xs, ys, x_vels, y_vels, angles,
+                        angular_velocities):
+        """
+        Create one asteroid per row of the given arrays.
+        """
+        columns = [np.asarray(column, dtype=np.float64).tolist()
+                   for column in (xs, ys, x_vels, y_vels, angles,
+                                  angular_velocities)]
+        entity_ids = [self._init_asteroid(*values)
+                      for values in zip(*columns)]
+        self.app.count += len(entity_ids)
+        return entity_ids
 
+    def _init_asteroid(self, x, y, x_vel, y_vel, angle, angular_velocity):
+        ASSETS.require(ASTEROID_TEXTURE)
+        entity_id = self.pool.acquire(
+            'asteroid', x=x, y=y, x_vel=x_vel, y_vel=y_vel, angle=angle,
+            angular_velocity=angular_velocity)
+        self.pick_index.insert(entity_id, x, y, ASTEROID_PICK_RADIUS)
+        self.culler.add(entity_id)
+        return entity_id
 
     def create_asteroid(self, pos):
         x_vel = randint(-250, 250)
         y_vel = randint(-250, 250)
         angle = radians(randint(-360, 360))
         angular_velocity = radians(randint(-150, -150))
-        shape_dict = {'inner_radius': 0, 'outer_radius': 22, 
-            'mass': 50, 'offset': (0, 0)}
-        col_shape = {'shape_type': 'circle', 'elasticity': .5, 
-            'collision_type': 1, 'shape_info': shape_dict, 'friction': 1.0}
-        col_shapes = [col_shape]
-        physics_component = {'main_shape': 'circle', 
-            'velocity': (x_vel, y_vel), 
-            'position': pos, 'angle': angle, 
-            'angular_velocity': angular_velocity, 
-            'vel_limit': 500, 
-            'ang_vel_limit': radians(200), 
-            'mass': 50, 'col_shapes': col_shapes}
-        create_component_dict = {'cymunk_physics': physics_component, 
-            'rotate_color_renderer': {
-                'texture': 'asteroid1',
-                'size': (45, 45),
-                'render': True
-            },
-            'color': (255,255,255,255),
-            'position': pos, 'rotate': 0, }
-        component_order = ['position', 'rotate', 'color', 'rotate_color_renderer', 
-            'cymunk_physics',]
-        return self.gameworld.init_entity(
-            create_component_dict, component_order)
+        return self._init_asteroid(pos[0], pos[1], x_vel, y_vel, angle,
+                                   angular_velocity)
 
     def destroy_asteroid(self, ent_id):
         if ent_id is None: return #TODO: check if entity  is valid
-        gameview = self.gameworld.system_manager['camera1']
-        gameview.entity_to_focus = None        
-        self.app.selected_id = None
-        self.gameworld.remove_entity(ent_id)
-        self.app.count -= 1
+        if ent_id in self.selection:
+            gameview = self.gameworld.system_manager['camera1']
+            gameview.entity_to_focus = None
+            self.selection.discard(ent_id)
+        self._release_asteroids([ent_id])
+
+    def _release_asteroids(self, entity_ids):
+        inspector = self.inspector
+        pool = self.pool
+        pick_index = self.pick_index
+        culler = self.culler
+        entities = self.gameworld.entities
+        for entity_id in entity_ids:
+            inspector.unwatch(entity_id)
+            if entity_id not in culler.active:
+                # The pool (and remove_entity) expect the body in the space
+                add_to_space(pool.space, entities[entity_id].cymunk_physics)
+            # Parks the asteroid for reuse instead of removing it
+            pool.release(entity_id)
+            if entity_id in pick_index:
+                pick_index.remove(entity_id)
+            culler.remove(entity_id)
+        self.app.count -= len(entity_ids)
+
+    def save_scene(self, path):
+        """
+        Write all asteroids (position, rotation, color and physics state)
+        to a snapshot file, see demo_utils.snapshot.
+        """
+        entities = self.gameworld.entities
+        entity_ids = self.pick_index.entity_ids
+        n = len(entity_ids)
+        position = np.empty((n, 2), dtype=np.float32)
+        rotate = np.empty(n, dtype=np.float32)
+        color = np.empty((n, 4), dtype=np.uint8)
+        velocity = np.empty((n, 2), dtype=np.float32)
+        angular_velocity = np.empty(n, dtype=np.float32)
+        for i, entity_id in enumerate(entity_ids):
+            entity = entities[entity_id]
+            body = entity.cymunk_physics.body
+            position[i] = (entity.position.x, entity.position.y)
+            rotate[i] = entity.rotate.r
+            color[i] = entity.color.rgba
+            velocity[i] = (body.velocity.x, body.velocity.y)
+            angular_velocity[i] = body.angular_velocity
+        # Don't persist the selection highlight
+        rows = dict((entity_id, i) for i, entity_id in enumerate(entity_ids))
+        for entity_id, red in self._unselected_red.items():
+            if entity_id in rows:
+                color[rows[entity_id], 0] = red
+        save_snapshot(path, OrderedDict([
+            ('position', position), ('rotate', rotate), ('color', color),
+            ('velocity', velocity), ('angular_velocity', angular_velocity),
+            ]), meta={'demo': 'pick_object'})
+
+    def load_scene(self, path):
+        """
+        Add the asteroids of a snapshot file written by save_scene.
+        Returns the new entity ids.
+        """
+        snapshot = load_snapshot(path)
+        position = snapshot['position']
+        velocity = snapshot['velocity']
+        entity_ids = self._init_asteroids(
+            position[:, 0], position[:, 1], velocity[:, 0], velocity[:, 1],
+            snapshot['rotate'], snapshot['angular_velocity'])
+        # Asteroids are created white, only fix up the others
+        color = snapshot['color']
+        entities = self.gameworld.entities
+        for row in np.flatnonzero((color != 255).any(axis=1)).tolist():
+            entities[entity_ids[row]].color.rgba = tuple(color[row].tolist())
+        return entity_ids
 
     def set_asteroid_velocity(self, ent_id, vx=0, vy=0):
         if ent_id is None: return #TODO: check if entity  is valid
         entities = self.gameworld.entities
         ent = entities[ent_id].cymunk_physics
         ent.body.velocity = (vx, vy)
+        self.inspector.refresh()
+
+    def _selected_bodies(self):
+        entities = self.gameworld.entities
+        return [entities[entity_id].cymunk_physics.body
+                for entity_id in self.selection]
+
+    def set_selection_velocity(self, vx=0, vy=0):
+        velocity = (vx, vy)
+        for body in self._selected_bodies():
+            body.velocity = velocity
+        self.inspector.refresh()
+
+    def scale_selection_velocity(self, factor):
+        bodies = self._selected_bodies()
+        if not bodies:
+            return
+        velocities = np.array([(body.velocity.x, body.velocity.y)
+                               for body in bodies]) * factor
+        for body, velocity in zip(bodies, velocities.tolist()):
+            body.velocity = tuple(velocity)
+        self.inspector.refresh()
+
+    def zero_selection_forces(self):
+        """
+        Clear the forces and torques accumulated on the selected bodies.
+        """
+        for body in self._selected_bodies():
+            body.reset_forces()
+
+    def recolor_selection(self, rgba):
+        rgba = tuple(rgba)
+        entities = self.gameworld.entities
+        unselected_red = self._unselected_red
+        for entity_id in self.selection:
+            color = entities[entity_id].color
+            color.rgba = rgba
+            # Keep the highlight, restore the new red on deselection
+            unselected_red[entity_id] = color.r
+            color.r = 0
+
+    def destroy_selection(self):
+        entity_ids = self.selection.entity_ids
+        if not entity_ids:
+            return
+        gameview = self.gameworld.system_manager['camera1']
+        gameview.entity_to_focus = None
+        self.selection.clear()
+        self._release_asteroids(entity_ids)
 
 
 
 class YourAppNameApp(App):
     count = NumericProperty(0)
     fps = NumericProperty(0)
+    queued = NumericProperty(0)
+    visible = NumericProperty(0)
+    active = NumericProperty(0)
+    profile_text = StringProperty('')
+    show_profile = BooleanProperty(True)
+    scene_path = StringProperty('scene.kvsnap')
     
-    selected_id = None
+    selected_id = ObjectProperty(None, allownone=True)
+    selected_count = NumericProperty(0)
     selected_coords = ObjectProperty(None, allownone=True)
     selected_velocity = ObjectProperty(None, allownone=True)    
     def __init__(self, **kwargs):
@@ -147,15 +577,34 @@ class YourAppNameApp(App):
         
     def update_stats(self, dt):
         self.fps = int(Clock.get_fps())
-        if self.selected_id is None:
+        if self.show_profile and hasattr(self.root, 'profiler'):
+            self.profile_text = self.root.profiler.format_table()
+        Clock.schedule_once(self.update_stats, .5)
+
+    def on_selected_id(self, _, entity_id):
+        inspector = self.root.inspector
+        inspector.clear()
+        if entity_id is None:
             self.selected_coords = None
             self.selected_velocity = None
         else:
-            ent = self.root.gameworld.entities[self.selected_id]
-            physics = ent.cymunk_physics
-            self.selected_coords = (int(ent.position.x), int(ent.position.y))
-            self.selected_velocity = (physics.body.velocity.x, physics.body.velocity.y)                        
-        Clock.schedule_once(self.update_stats, .5)
+            inspector.watch(entity_id)
+
+    def on_inspector_change(self, inspector, entity_ids):
+        entity_id = self.selected_id
+        if entity_id is None or entity_id not in inspector:
+            return
+        changed = inspector.changed_fields(entity_id)
+        x, y, vx, vy = inspector.get(entity_id)
+        if 'x' in changed or 'y' in changed:
+            self.selected_coords = (int(x), int(y))
+        if 'vx' in changed or 'vy' in changed:
+            self.selected_velocity = (vx, vy)
+
+    def on_stop(self):
+        # PROFILE_EXPORT, RECORD_INPUT and ZONE_REPORT, see
+        # demo_utils.session
+        self.root.finish_session()
         
     
 
@@ -0,0 +1,165 @@
+"""
+Prefabs and entity pooling.
+
+A prefab holds the precomputed component dicts of one entity archetype
+(like "asteroid"), so creating an entity only means filling in the per
+entity values and calling init_entity.
+
+EntityPool parks released entities instead of removing them: they stop
+rendering and their physics body (and shapes) leave the cymunk space, so
+they don't collide, aren't found by queries and cost the solver nothing.
+acquire hands parked entities out again with new state, which avoids the
+allocations remove_entity + init_entity would cause in the renderer,
+physics and component zones.
+"""
+from collections import defaultdict
+
+
+def remove_from_space(space, physics):
+    """
+    Take the body and shapes of a physics component out of the space.
+    """
+    for shape in physics.shapes:
+        space.remove(shape)
+    space.remove(physics.body)
+
+
+def add_to_space(space, physics):
+    space.add(physics.body)
+    for shape in physics.shapes:
+        space.add(shape)
+
+
+class Prefab(object):
+    """
+    setup(components, **state) writes the per entity state into the
+    template before init_entity, restore(entity, **state) applies the
+    same state to a parked entity.
+    """
+    def __init__(self, name, components, component_order, setup, restore):
+        self.name = name
+        self.components = components
+        self.component_order = component_order
+        self.setup = setup
+        self.restore = restore
+
+    def create(self, gameworld, **state):
+        self.setup(self.components, **state)
+        return gameworld.init_entity(self.components, self.component_order)
+
+
+class PrefabRegistry(object):
+    def __init__(self):
+        self._prefabs = {}
+
+    def register(self, name, components, component_order, setup, restore):
+        prefab = Prefab(name, components, component_order, setup, restore)
+        self._prefabs[name] = prefab
+        return prefab
+
+    def __getitem__(self, name):
+        return self._prefabs[name]
+
+    def __contains__(self, name):
+        return name in self._prefabs
+
+    def create(self, gameworld, name, **state):
+        return self._prefabs[name].create(gameworld, **state)
+
+
+class EntityPool(object):
+    """
+    Pool of parked entities per prefab.
+    At most max_parked entities are kept per prefab, everything released
+    above that is really removed.
+    """
+    def __init__(self, gameworld, registry, max_parked=10000,
+                 physics_system='cymunk_physics',
+                 renderer_system='rotate_color_renderer'):
+        self.gameworld = gameworld
+        self.registry = registry
+        self.max_parked = max_parked
+        self.physics_system = physics_system
+        self.renderer_system = renderer_system
+        self._parked = defaultdict(list)
+        self._prefab_of = {}
+        self.hits = 0
+        self.misses = 0
+        self.releases = 0
+
+    @property
+    def space(self):
+        return self.gameworld.system_manager[self.physics_system].space
+
+    def acquire(self, name, **state):
+        """
+        Get an entity of the given prefab with the given state,
+        reusing a parked one if possible.
+        """
+        parked = self._parked[name]
+        if parked:
+            entity_id = parked.pop()
+            entity = self.gameworld.entities[entity_id]
+            self.registry[name].restore(entity, **state)
+            self._unpark(entity)
+            self.hits += 1
+        else:
+            entity_id = self.registry.create(self.gameworld, name, **state)
+            self.misses += 1
+        self._prefab_of[entity_id] = name
+        return entity_id
+
+    def release(self, entity_id):
+        """
+        Park an entity acquired from this pool.
+        Entities not created by the pool are simply removed.
+        """
+        name = self._prefab_of.pop(entity_id, None)
+        self.releases += 1
+        if name is None or len(self._parked[name]) >= self.max_parked:
+            self.gameworld.remove_entity(entity_id)
+            return
+        self._park(self.gameworld.entities[entity_id])
+        self._parked[name].append(entity_id)
+
+    def owns(self, entity_id):
+        """
+        True if entity_id is a live entity handed out by this pool.
+        """
+        return entity_id in self._prefab_of
+
+    def _park(self, entity):
+        getattr(entity, self.renderer_system).render = False
+        physics = getattr(entity, self.physics_system, None)
+        if physics is not None:
+            remove_from_space(self.space, physics)
+
+    def _unpark(self, entity):
+        physics = getattr(entity, self.physics_system, None)
+        if physics is not None:
+            add_to_space(self.space, physics)
+        getattr(entity, self.renderer_system).render = True
+
+    def clear(self):
+        """
+        Really remove all parked entities.
+        """
+        entities = self.gameworld.entities
+        for parked in self._parked.values():
+            for entity_id in parked:
+                # The physics system expects its bodies in the space
+                # when removing them.
+                self._unpark(entities[entity_id])
+                self.gameworld.remove_entity(entity_id)
+            del parked[:]
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': float(self.hits) / lookups if lookups else 0.,
+            'releases': self.releases,
+            'live': len(self._prefab_of),
+            'parked': sum(len(parked) for parked in self._parked.values()),
+        }